@@ -1,16 +1,29 @@
 #! /usr/bin/python
 
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 import colour
+import numpy as np
+import hashlib
+import os
 
 
 # The following should be some inherited class, BasicGradientSource
 class BasicSource:
+    # compiled gradients are stored here, one file per get_colors() stops
+    GRADIENT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gradient_cache")
+    # interpolation of the sources that are rendered at lower resolution than one LED, LINEAR or CUBIC
+    UPSAMPLING = "CUBIC"
+
     def __init__(self, time_speed, output_type):
         self.nLed = 0
         self.time_speed = time_speed
         self.gradient = []
+        self.gradient_packed = np.zeros(0, dtype=np.uint32)  # colors as int, the way rpi_ws281x Color() packs them
+        self.gradient_rgb = np.zeros((0, 3), dtype=np.uint8)
+        self.gradient_y = np.zeros(0)
         self.output_type = output_type
+        # the source renders only colors (render_rgb), it has no gradient indices and its render_frame raises
+        self.rgb_only = False
 
     def get_colors(self) -> List[Tuple]:
         # the number of step should add to 101, but if it is more, the extra colors will simply never be used
@@ -33,29 +46,139 @@ class BasicSource:
         else:
             return 1.0 - BasicSource.bias(2.0 - x * 2.0, w) / 2.0
 
-    def init(self, n_led):
-        self.nLed = n_led
-        led_colors = self.get_colors()
+    @staticmethod
+    def gain_array(x: np.ndarray, w) -> np.ndarray:
+        """
+        Same as gain, but for the whole array of values at once
+        """
+        y = np.empty_like(x)
+        low = x < 0.5
+        y[low] = BasicSource.bias(x[low] * 2.0, w) / 2.0
+        y[~low] = 1.0 - BasicSource.bias(2.0 - x[~low] * 2.0, w) / 2.0
+        return y
+
+    @staticmethod
+    def pack_rgb(rgb: np.ndarray) -> np.ndarray:
+        """
+        :param rgb: array of shape (n, 3) of bytes
+        :return: array of colors packed into uint32
+        """
+        rgb = rgb.astype(np.uint32)
+        return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+    @staticmethod
+    def rgb_to_hex(rgb: np.ndarray) -> np.ndarray:
+        return np.array(["#%02x%02x%02x" % (r, g, b) for r, g, b in rgb.tolist()])
+
+    @staticmethod
+    def compile_gradient(led_colors: List[Tuple]) -> np.ndarray:
+        """
+        Interpolates the color stops
+        :param led_colors: stops as returned by get_colors
+        :return: array of shape (n, 3) of bytes
+        """
+        rgb = []
         for i in range(len(led_colors) - 1):
             for c in colour.Color(led_colors[i][0]).range_to(colour.Color(led_colors[i + 1][0]), led_colors[i][1]):
-                if self.output_type == "LED":
-                    val = (BasicSource.float2int(c.red) << 16) | (BasicSource.float2int(c.green) << 8) | BasicSource.float2int(c.blue)
-                    self.gradient.append(val)
-                elif self.output_type == "HEX":
-                    self.gradient.append(c.hex)
-                elif self.output_type == "Y":
-                    self.gradient.append(len(self.gradient) / 100)
+                rgb.append((BasicSource.float2int(c.red), BasicSource.float2int(c.green), BasicSource.float2int(c.blue)))
+        return np.array(rgb, dtype=np.uint8).reshape(-1, 3)
+
+    @staticmethod
+    def load_gradient(led_colors: List[Tuple]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the compiled gradient tables (rgb, packed, y), either from the disk cache or freshly compiled
+        """
+        key = hashlib.sha1(repr(led_colors).encode()).hexdigest()
+        cache_file = os.path.join(BasicSource.GRADIENT_CACHE, key + ".npz")
+        try:
+            with np.load(cache_file) as cached:
+                return cached["rgb"], cached["packed"], cached["y"]
+        except (OSError, KeyError, ValueError):
+            pass
+        rgb = BasicSource.compile_gradient(led_colors)
+        packed = BasicSource.pack_rgb(rgb)
+        y = np.arange(len(rgb)) / 100
+        try:
+            os.makedirs(BasicSource.GRADIENT_CACHE, exist_ok=True)
+            tmp_file = cache_file + ".%s.tmp.npz" % os.getpid()
+            np.savez(tmp_file, rgb=rgb, packed=packed, y=y)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print("Cannot cache gradient: %s" % e)
+        return rgb, packed, y
+
+    def init(self, n_led):
+        self.nLed = n_led
+        self.gradient_rgb, self.gradient_packed, self.gradient_y = BasicSource.load_gradient(self.get_colors())
+        if self.output_type == "LED":
+            self.gradient = self.gradient_packed
+        elif self.output_type == "HEX":
+            self.gradient = BasicSource.rgb_to_hex(self.gradient_rgb)
+        elif self.output_type == "Y":
+            self.gradient = self.gradient_y
+
+    def share_gradient(self, source: "BasicSource"):
+        """
+        Uses the gradient tables of another source, this is for the sources that wrap other sources
+        """
+        self.gradient = source.gradient
+        self.gradient_packed = source.gradient_packed
+        self.gradient_rgb = source.gradient_rgb
+        self.gradient_y = source.gradient_y
+
+    def get_cache_key(self) -> Tuple:
+        """
+        :return: everything that determines the frames of the source, saved frames are reused only with the same key
+        """
+        return type(self).__name__, self.get_colors(), self.time_speed
+
+    def get_period(self) -> Optional[int]:
+        """
+        :return: number of frames after which the animation repeats, None if it does not
+        """
+        return None
+
+    def rgb_to_output(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        Converts colors to the format of output_type, for Y the brightness of the color is used
+        :param rgb: array of shape (nLed, 3) of bytes
+        """
+        if self.output_type == "LED":
+            return BasicSource.pack_rgb(rgb)
+        elif self.output_type == "HEX":
+            return BasicSource.rgb_to_hex(rgb)
+        else:
+            return rgb @ np.array([0.2126, 0.7152, 0.0722]) / 255
+
+    def advance(self, frame: int):
+        """
+        Updates the state of the animation for the frame without rendering it. The sources that change their state
+        in render_frame must do it here (and call advance from render_frame), so that the frames can be rendered
+        out of order by several renderers, each of them advancing through the frames it does not render
+        """
+        pass
 
     def update_leds(self, frame: int, strip):
-        for i in range(self.nLed):
-            y = self.get_gradient_index(i, frame)
-            if y > len(self.gradient) - 1:
-                print(y)
-            strip.setPixelColor(i, self.gradient[y])
+        strip.write_frame(self.gradient[self.render_frame(frame)])
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        """
+        Returns gradient indices of all LEDs for the frame. This is the function to override in the implementations,
+        the default calls get_gradient_index for every LED, so the sources that implement only that one still work
+        :param frame:
+        :return: integer array of length nLed, the caller must not modify it (it may be a read only view)
+        """
+        return np.fromiter((self.get_gradient_index(i, frame) for i in range(self.nLed)), dtype=np.intp, count=self.nLed)
+
+    def render_rgb(self, frame: int) -> np.ndarray:
+        """
+        :return: colors of all LEDs for the frame, array of shape (nLed, 3) of bytes
+        """
+        return self.gradient_rgb[self.render_frame(frame)]
 
     def get_gradient_index(self, i, frame):
         """
-        This is the function to override in the implementations
+        Per-LED version of render_frame, slow, but simple to write when prototyping new sources
         :param i:
         :param frame:
         :return:
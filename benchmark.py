@@ -0,0 +1,135 @@
+#! /usr/bin/python
+
+"""
+Measures the cost of the sources without any output and sleeping: every source renders the frames to DummyStrip
+for all combinations of LED counts and time speeds. For every run the frames per second, percentiles of the frame
+time and the memory allocated per frame are reported and saved to json, so that the results of two versions can
+be compared.
+"""
+
+from basic_source import BasicSource
+from perlin_source import PerlinSource
+from fire_source import FireSource
+from color_source import ColorSource
+from morse_source import MorseSource
+from strips import DummyStrip
+import numpy as np
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+SOURCES = {
+    "BASIC": lambda ts: BasicSource(ts, "LED"),
+    "EMBERS": lambda ts: FireSource(ts, "LED"),
+    "PERLIN": lambda ts: PerlinSource(ts, "LED"),
+    "COLOR": lambda ts: ColorSource(ts, "LED", ["#FF0000", "#000000", "#000000"]),
+    "MORSE": lambda ts: MorseSource(ts, "LED"),
+}
+
+
+def create_source(name, time_speed, n_led) -> BasicSource:
+    random.seed(0)  # the same embers and noise for every run
+    with contextlib.redirect_stdout(io.StringIO()):  # the sources print debug info
+        source = SOURCES[name](time_speed)
+        source.init(n_led)
+    return source
+
+
+def measure_time(source: BasicSource, strip, frames, warmup) -> np.ndarray:
+    for frame in range(1, warmup + 1):
+        source.update_leds(frame, strip)
+        strip.show()
+    times = np.zeros(frames, dtype=np.int64)
+    for i in range(frames):
+        frame = warmup + 1 + i
+        start = time.perf_counter_ns()
+        source.update_leds(frame, strip)
+        strip.show()
+        times[i] = time.perf_counter_ns() - start
+    return times
+
+
+def measure_allocations(source: BasicSource, strip, first_frame, frames):
+    """
+    :return: mean of the peak memory allocated while rendering a frame and mean number of memory blocks
+             still allocated after the frame, in bytes and blocks
+    """
+    tracemalloc.start()
+    peaks = []
+    retained_blocks = 0
+    for frame in range(first_frame, first_frame + frames):
+        before = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        source.update_leds(frame, strip)
+        strip.show()
+        retained_blocks += sys.getallocatedblocks() - blocks
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return float(np.mean(peaks)), retained_blocks / frames
+
+
+def run(name, n_led, time_speed, frames, warmup, alloc_frames):
+    result = {"source": name, "leds": n_led, "time_speed": time_speed, "frames": frames}
+    try:
+        source = create_source(name, time_speed, n_led)
+        strip = DummyStrip()
+        times = measure_time(source, strip, frames, warmup) / 10 ** 6
+        alloc_bytes, alloc_blocks = measure_allocations(source, strip, warmup + frames + 1, alloc_frames)
+    except Exception as e:
+        result["error"] = repr(e)
+        return result
+    result["fps"] = frames / times.sum() * 1000
+    for p in (50, 90, 99):
+        result["p%s_ms" % p] = float(np.percentile(times, p))
+    result["max_ms"] = float(times.max())
+    result["alloc_peak_bytes_per_frame"] = alloc_bytes
+    result["retained_blocks_per_frame"] = alloc_blocks
+    return result
+
+
+def print_result(r):
+    if "error" in r:
+        print("%-7s %6s %3s  error: %s" % (r["source"], r["leds"], r["time_speed"], r["error"]))
+        return
+    print("%-7s %6s %3s %10.1f %8.3f %8.3f %8.3f %8.3f %12.0f %8.2f" %
+          (r["source"], r["leds"], r["time_speed"], r["fps"], r["p50_ms"], r["p90_ms"], r["p99_ms"], r["max_ms"],
+           r["alloc_peak_bytes_per_frame"], r["retained_blocks_per_frame"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the sources rendering to DummyStrip')
+    parser.add_argument('-s', '--sources', nargs='+', choices=list(SOURCES.keys()), default=list(SOURCES.keys()))
+    parser.add_argument('-l', '--leds', nargs='+', type=int, default=[150, 454, 1000, 4000])
+    parser.add_argument('-t', '--timespeed', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('-n', '--frames', type=int, default=300, help='measured frames per run')
+    parser.add_argument('-w', '--warmup', type=int, default=20, help='frames rendered before measuring')
+    parser.add_argument('-a', '--alloc-frames', type=int, default=50, help='frames traced for allocations')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='json file for the results')
+    args = parser.parse_args()
+
+    results = []
+    print("%-7s %6s %3s %10s %8s %8s %8s %8s %12s %8s" %
+          ("source", "leds", "ts", "fps", "p50 ms", "p90 ms", "p99 ms", "max ms", "alloc B/fr", "blocks"))
+    for source_name in args.sources:
+        for leds in args.leds:
+            for ts in args.timespeed:
+                res = run(source_name, leds, ts, args.frames, args.warmup, args.alloc_frames)
+                print_result(res)
+                results.append(res)
+    with open(args.output, "w") as f:
+        json.dump({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "results": results
+        }, f, indent=2)
+    print("Results saved to %s" % args.output)
@@ -4,6 +4,7 @@ from basic_source import BasicSource
 from math import pi, cos
 from random import random
 from typing import List
+import numpy as np
 
 
 class ColorSource(BasicSource):
@@ -22,7 +23,7 @@ class ColorSource(BasicSource):
         #return colors
         return [("#FEFEFF", 19), ("#239eeb", 1), ("#FFFEFE", 19), ("#FF0000", 1)]
 
-    def update_leds(self, frame: int, strip):
+    def update_heads(self, frame: int):
         mframe = frame % self.nLed
         for i in range(len(self.heads)):
             #self.shift[i] += int(random() * 4 - 2)
@@ -30,7 +31,25 @@ class ColorSource(BasicSource):
         self.cur_heads[0] = (self.cur_heads[0] + int(0.5 * mframe)) % self.nLed
         self.cur_heads[1] = (self.cur_heads[1] + int(0.5 * mframe)) % self.nLed
         #print(self.shift)
-        super().update_leds(frame, strip)
+
+    def get_period(self):
+        return self.nLed
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        self.update_heads(frame)
+        leds = np.arange(self.nLed)
+        heads = np.array(self.cur_heads)
+        # stable sort, so that of the heads at the same position the first one is found, like in the loop below
+        order = np.argsort(heads, kind="stable")
+        sorted_heads = heads[order]
+        # the nearest head ahead of every led, the leds after the last head wrap around to the first one
+        nearest = np.searchsorted(sorted_heads, leds, side="left")
+        nearest[nearest == len(heads)] = 0
+        min_i = order[nearest]
+        min_dist = (sorted_heads[nearest] - leds) % self.nLed
+        y = np.where(min_i < 2, 38 - min_dist, 19 - min_dist)
+        y[min_dist > 18] = 0
+        return y
 
     def get_gradient_index(self, led, frame):
         #heads = [0, 150, 300, 375]
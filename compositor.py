@@ -0,0 +1,91 @@
+#! /usr/bin/python
+
+from basic_source import BasicSource
+from typing import List
+import numpy as np
+
+
+class Layer:
+    """
+    Source shown on a part of the strip
+    """
+    BLENDS = ["ADD", "MAX", "ALPHA", "MULTIPLY"]
+
+    def __init__(self, source: BasicSource, start: int = 0, length: int = None, blend: str = "ADD",
+                 opacity: float = 1.0):
+        """
+        :param source: it is initialized with the length of the layer, its LED 0 is at start
+        :param start: first LED of the strip covered by the layer
+        :param length: number of LEDs, None for the rest of the strip
+        :param blend: how the layer is combined with the layers below it, one of BLENDS
+        :param opacity: weight of the layer, 0 to 1, for ALPHA the layer is mixed with the layers below in this ratio
+        """
+        if blend not in Layer.BLENDS:
+            raise ValueError("Unknown blend %s, use one of %s" % (blend, ", ".join(Layer.BLENDS)))
+        self.source = source
+        self.start = start
+        self.length = length
+        self.blend = blend
+        self.opacity = opacity
+        self.end = start
+
+
+class CompositorSource(BasicSource):
+    """
+    Stacks several sources, the first layer is at the bottom. Every layer renders only its part of the strip in its
+    own colors and the parts are blended as whole arrays, the LEDs that no layer covers are black.
+    The update_leds of the layers are not used, only render_rgb
+    """
+    def __init__(self, time_speed, output_type, layers: List[Layer]):
+        super().__init__(time_speed, output_type)
+        self.layers = layers
+        self.rgb_only = True
+        self.visible = []
+        self.rgb = np.zeros((0, 3), dtype=np.float32)
+
+    def init(self, n_led):
+        super().init(n_led)
+        self.rgb = np.zeros((n_led, 3), dtype=np.float32)
+        self.visible = []
+        for layer in self.layers:
+            layer.start = min(max(layer.start, 0), n_led)
+            layer.end = n_led if layer.length is None else min(layer.start + layer.length, n_led)
+            if layer.end == layer.start:
+                print("Layer %s is outside of the strip, it will not be rendered" % type(layer.source).__name__)
+                continue
+            layer.source.init(layer.end - layer.start)
+            self.visible.append(layer)
+
+    def advance(self, frame: int):
+        for layer in self.visible:
+            layer.source.advance(frame)
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        raise NotImplementedError("CompositorSource has no gradient, it renders only colors with render_rgb")
+
+    def render_rgb(self, frame: int) -> np.ndarray:
+        out = self.rgb
+        out.fill(0)
+        for layer in self.visible:
+            region = out[layer.start:layer.end]
+            rgb = layer.source.render_rgb(frame).astype(np.float32)
+            if layer.blend == "ADD":
+                rgb *= layer.opacity
+                region += rgb
+            elif layer.blend == "MAX":
+                rgb *= layer.opacity
+                np.maximum(region, rgb, out=region)
+            elif layer.blend == "ALPHA":
+                region *= 1 - layer.opacity
+                rgb *= layer.opacity
+                region += rgb
+            elif layer.blend == "MULTIPLY":
+                # opacity 0 leaves the layers below unchanged
+                rgb *= layer.opacity / 255
+                rgb += 1 - layer.opacity
+                region *= rgb
+        np.clip(out, 0, 255, out=out)
+        return (out + 0.5).astype(np.uint8)
+
+    def update_leds(self, frame: int, strip):
+        strip.write_frame(self.rgb_to_output(self.render_rgb(frame)))
@@ -1,41 +1,86 @@
 #! /usr/bin/python
 
 from basic_source import BasicSource
+from upsampler import Upsampler
 from random import random
-from math import cos, pi, exp, fabs, sqrt
+from math import pi, exp, fabs, sqrt, ceil, gcd, lcm
+from functools import lru_cache
+from typing import List, Tuple
+import numpy as np
+
+
+def build_contrib_table(osc_ratio, osc_freq, sigma) -> np.ndarray:
+    """
+    Contribution table shared by all embers with the same (quantized) parameters. The rows are oscillation steps,
+    the columns are distances -6 sigma .. 6 sigma. The amplitude of the ember is factored out, because
+    (amp + osc) * e^(-1/2 (x / sig * amp / (amp + osc))^2) = amp * (1 + r) * e^(-1/2 (x / sig / (1 + r))^2)
+    where r = osc / amp
+    """
+    peak = 1.0 + osc_ratio * np.cos(np.arange(Ember.get_period(osc_freq)) * osc_freq)
+    x = np.arange(ceil(12 * sigma)) - 6 * sigma
+    return (peak[:, np.newaxis] * np.exp(-0.5 * (x / sigma / peak[:, np.newaxis]) ** 2)).astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def get_contrib_table(osc_ratio, osc_freq, sigma) -> np.ndarray:
+    """
+    build_contrib_table for Ember.get_contrib, the number of tables is limited by the quantization of the parameters
+    """
+    return build_contrib_table(osc_ratio, osc_freq, sigma)
 
 
 class Ember:
+    # oscillation frequency and sigma are rounded to these steps, so that the embers can share contribution tables
+    OSC_FREQ_STEP = 0.0005
+    SIGMA_STEP = 0.25
+
     def __init__(self, i, ember_data, age, ember_type):
+        self.reset(i, ember_data, age, ember_type)
+
+    def reset(self, i, ember_data, age, ember_type):
+        """
+        Sets new random parameters, used to recycle expired sparks instead of creating new ones
+        """
         amp = ember_data["amp"] + random() * ember_data["amp_rand"]
         self.i = i
         self.x = (i - 1 + random()/3.0) * ember_data["x_space"]
         self.amp = amp
-        self.osc_amp = amp * ember_data["osc_amp"]
-        self.osc_freq = ember_data["osc_freq"] + random() * ember_data["osc_freq_rand"]
+        self.osc_ratio = ember_data["osc_amp"]
+        self.osc_amp = amp * self.osc_ratio
+        self.osc_freq = Ember.quantize(ember_data["osc_freq"] + random() * ember_data["osc_freq_rand"], Ember.OSC_FREQ_STEP)
+        self.period = Ember.get_period(self.osc_freq)
+        # the phase shift is rounded to whole oscillation steps and applied as the shift of the table row
         self.osc_shift = random() * 2 * pi
-        self.sigma = ember_data["sigma"] + random() * ember_data["sigma_rand"]
+        self.shift_row = int(round(self.osc_shift / self.osc_freq)) % self.period
+        self.sigma = Ember.quantize(ember_data["sigma"] + random() * ember_data["sigma_rand"], Ember.SIGMA_STEP)
         self.decay = ember_data["decay"] + ember_data["decay_rand"] * random()
         self.age = age
         if self.decay > 0:
             peak_age = sqrt(10.0 / self.decay)
             self.age += peak_age
         self.type = ember_type
-        self.cos_table = []
-        self.contrib_table = []
-        t = 0
-        while t * self.osc_freq < 2 * pi:
-            self.cos_table.append(cos(t * self.osc_freq + self.osc_shift))
-            contrib = []
-            x = -6 * self.sigma
-            while x < 6 * self.sigma:
-                osc = self.osc_amp * self.cos_table[t]
-                c = (self.amp + osc) * exp(-0.5 * ((x / self.sigma * self.amp / (self.amp + osc)) ** 2))
-                contrib.append(c)
-                x += 1
-            self.contrib_table.append(contrib)
-            t += 1
 
+    @staticmethod
+    def quantize(value, step):
+        return round(value / step) * step
+
+    @staticmethod
+    def get_keys(ember_data):
+        """
+        :return: all (osc_ratio, osc_freq, sigma) of the contribution tables that reset can choose for the type
+        """
+        def grid(value, rand, step):
+            return [k * step for k in range(round(value / step), round((value + rand) / step) + 1)]
+        return [(ember_data["osc_amp"], osc_freq, sigma)
+                for osc_freq in grid(ember_data["osc_freq"], ember_data["osc_freq_rand"], Ember.OSC_FREQ_STEP)
+                for sigma in grid(ember_data["sigma"], ember_data["sigma_rand"], Ember.SIGMA_STEP)]
+
+    @staticmethod
+    def get_period(osc_freq):
+        """
+        :return: number of oscillation steps t for which t * osc_freq < 2 pi
+        """
+        return int(ceil(2 * pi / osc_freq))
 
     def get_contrib(self, x, t):
         """
@@ -44,15 +89,93 @@ class Ember:
         :param t:
         :return:
         """
-        cos_t = t % len(self.cos_table)
+        cos_t = (t + self.shift_row) % self.period
         dx = int(self.x - x + 6 * self.sigma)
+        c = self.amp * get_contrib_table(self.osc_ratio, self.osc_freq, self.sigma)[cos_t][dx]
         if self.decay == 0:
-            return self.contrib_table[cos_t][dx]
+            return c
         else:
-            return self.contrib_table[cos_t][dx] * exp(-0.5 * self.decay * (self.age - t)**2)
+            return c * exp(-0.5 * self.decay * (self.age - t)**2)
+
+
+class EmberField:
+    """
+    Parameters of a group of embers stored as arrays, so that the contributions of all of them are evaluated in
+    one go. Every ember contributes only to the LEDs closer than 6 sigma, so the field is a banded matrix with one
+    row per ember and the band of LEDs in columns, the rows are then added to the strip.
+    The contributions are gathered from the contribution tables, which are concatenated into one flat array when
+    the field is created, so recycling an ember only changes the indices.
+    With step > 1, the field is evaluated only at every step-th LED (samples), to be upsampled later
+    """
+    def __init__(self, embers: List[Ember], max_sigma, step: int = 1, keys: List[Tuple] = None):
+        """
+        :param keys: (osc_ratio, osc_freq, sigma) of the tables the recycled embers can use (Ember.get_keys)
+        """
+        n = len(embers)
+        self.embers = embers
+        self.amp = np.zeros(n)
+        self.shift_row = np.zeros(n, dtype=np.intp)
+        self.period = np.ones(n, dtype=np.intp)
+        self.decay = np.zeros(n)
+        self.age = np.zeros(n)
+        self.step = step
+        self.table_offsets = {}  # (osc_ratio, osc_freq, sigma) -> offset in tables and number of columns
+        self.tables = self.build_tables(set(keys or []) | {(e.osc_ratio, e.osc_freq, e.sigma) for e in embers})
+        width = int(ceil(12 * max_sigma / step)) + 2
+        self.leds = np.zeros((n, width), dtype=np.intp)
+        self.base = np.zeros((n, width), dtype=np.intp)  # index of the sample in the first row of the table
+        self.row_size = np.zeros(n, dtype=np.intp)
+        self.band = np.zeros((n, width), dtype=bool)
+        for row in range(n):
+            self.update_row(row)
+
+    def build_tables(self, keys) -> np.ndarray:
+        tables = []
+        offset = 0
+        for key in sorted(keys):
+            table = build_contrib_table(*key)
+            self.table_offsets[key] = (offset, table.shape[1])
+            tables.append(table.ravel())
+            offset += table.size
+        return np.concatenate(tables)
+
+    def update_row(self, row):
+        """
+        Copies the parameters of the ember to the arrays, must be called when the ember is recycled
+        """
+        e = self.embers[row]
+        self.amp[row] = e.amp
+        self.shift_row[row] = e.shift_row
+        self.period[row] = e.period
+        self.decay[row] = e.decay
+        self.age[row] = e.age
+        samples = int(np.floor((e.x - 6 * e.sigma) / self.step)) + np.arange(self.leds.shape[1])
+        self.leds[row] = samples
+        self.band[row] = np.abs(samples * self.step - e.x) < 6 * e.sigma
+        offset, self.row_size[row] = self.table_offsets[(e.osc_ratio, e.osc_freq, e.sigma)]
+        # the ember is at the whole LED, the same as in Ember.get_contrib, the columns outside of the band are unused
+        columns = int(np.floor(e.x + 6 * e.sigma)) - samples * self.step
+        self.base[row] = offset + np.where(self.band[row], columns, 0)
+
+    def get_contrib(self, t, n_led) -> np.ndarray:
+        """
+        Same as Ember.get_contrib summed over all embers, for all LEDs (samples)
+        :param t:
+        :param n_led: number of samples
+        :return: array of length n_led
+        """
+        index = self.base + (((t + self.shift_row) % self.period) * self.row_size)[:, np.newaxis]
+        weight = self.amp * np.exp(-0.5 * self.decay * (self.age - t) ** 2)
+        contrib = self.tables[index] * weight[:, np.newaxis]
+        mask = self.band & (self.leds >= 0) & (self.leds < n_led)
+        return np.bincount(self.leds[mask], weights=contrib[mask], minlength=n_led)
 
 
 class FireSource(BasicSource):
+    # big and small embers are smooth enough to be evaluated every COARSE_STEP LEDs and upsampled,
+    # sparks are evaluated at every LED
+    COARSE_STEP = 4
+    COARSE_EMBERS = ["big", "small"]
 
     EMBERS = {  # x_space = N_LEDS / (count - 2)
         "big": {"amp": 0.4, "amp_rand": 0.1, "x_space": 100, "sigma": 30, "sigma_rand": 2,
@@ -66,9 +189,13 @@ class FireSource(BasicSource):
     def __init__(self, ts, output_type):
         super().__init__(ts, output_type)
         self.embers = []
+        self.fields = []
+        self.field_rows = []  # (field, row) for every ember
+        self.upsampler = None
 
     def init(self, n_led):
         super().init(n_led)
+        self.upsampler = Upsampler(n_led, FireSource.COARSE_STEP, BasicSource.UPSAMPLING)
         self.build_embers()
 
     def get_colors(self):
@@ -82,18 +209,55 @@ class FireSource(BasicSource):
                 self.embers.append(Ember(i, ember_data, 0, ember_type))
                 i += 1
                 x += ember_data["x_space"]
+        self.build_fields()
+
+    def build_fields(self):
+        # one field per type, so that the band of sparks is not as wide as the band of big embers
+        self.fields = []
+        self.field_rows = [None] * len(self.embers)
+        for ember_type, ember_data in FireSource.EMBERS.items():
+            indices = [i for i, e in enumerate(self.embers) if e.type == ember_type]
+            step = FireSource.COARSE_STEP if ember_type in FireSource.COARSE_EMBERS else 1
+            # the sparks are recycled with new parameters, all their tables are built now and not during the animation
+            keys = Ember.get_keys(ember_data) if ember_type == "spark" else None
+            field = EmberField([self.embers[i] for i in indices],
+                               ember_data["sigma"] + ember_data["sigma_rand"] + Ember.SIGMA_STEP, step, keys)
+            self.fields.append(field)
+            for row, i in enumerate(indices):
+                self.field_rows[i] = (field, row)
 
     def update_embers(self, frame):
         for i, e in enumerate(self.embers):
             if e.type == "spark" and e.age < frame and e.decay * (e.age - frame) ** 2 > 10:
-                # print("replacing ember")
-                self.embers[i] = Ember(e.i + int(2 * random() - 1), FireSource.EMBERS["spark"],
-                                       frame + 100 + 100 * random(), "spark")
+                # print("recycling ember")
+                e.reset(e.i + int(2 * random() - 1), FireSource.EMBERS["spark"], frame + 100 + 100 * random(), "spark")
+                field, row = self.field_rows[i]
+                field.update_row(row)
+
+    def get_period(self):
+        if any(e.decay > 0 for e in self.embers):
+            return None
+        period = lcm(*[e.period for e in self.embers])
+        return period // gcd(period, self.time_speed)
 
-    def update_leds(self, frame: int, strip):
+    def advance(self, frame: int):
         if frame % 4 == 0:
             self.update_embers(self.time_speed * frame)
-        super().update_leds(frame, strip)
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        self.advance(frame)
+        t = self.time_speed * frame
+        coarse = np.zeros(self.upsampler.get_samples())
+        y = np.zeros(self.nLed)
+        for field in self.fields:
+            if field.step == 1:
+                y += field.get_contrib(t, self.nLed)
+            else:
+                coarse += field.get_contrib(t, len(coarse))
+        y += self.upsampler.upsample(coarse)
+        np.clip(y, 0.0, 1.0, out=y)
+        y = BasicSource.gain_array(y, 0.25)
+        return (100 * y).astype(np.intp)
 
     def get_gradient_index(self, i, frame):
         y = 0
@@ -0,0 +1,68 @@
+#! /usr/bin/python
+
+import numpy as np
+import time
+
+
+class FrameProfiler:
+    """
+    Records the time spent in every phase of the frame to a ring buffer of the last frames. The frame is measured
+    by calling mark at the end of every phase, the phases must be marked in order. Only two calls of perf_counter_ns
+    and one write to the buffer per phase are done in the main loop, the percentiles are computed when reported
+    """
+    PHASES = ["wait", "advance", "render", "show"]
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self, capacity: int = 1024, report_frames: int = 0):
+        """
+        :param capacity: number of the last frames kept
+        :param report_frames: print the percentiles every report_frames frames, 0 for never
+        """
+        self.times = np.zeros((capacity, len(FrameProfiler.PHASES)), dtype=np.int64)
+        self.report_frames = report_frames
+        self.frames = 0
+        self.row = self.times[0]
+        self.last = 0
+
+    def start(self):
+        """
+        Starts the frame, the first phase is measured from now
+        """
+        self.row = self.times[self.frames % len(self.times)]
+        self.last = time.perf_counter_ns()
+
+    def mark(self, phase: int):
+        """
+        Ends the phase
+        :param phase: index of the phase to PHASES
+        """
+        now = time.perf_counter_ns()
+        self.row[phase] = now - self.last
+        self.last = now
+
+    def end(self):
+        """
+        Ends the frame, the time from the last mark is not counted
+        """
+        self.frames += 1
+        if self.report_frames > 0 and self.frames % self.report_frames == 0:
+            self.report()
+
+    def percentiles(self) -> np.ndarray:
+        """
+        :return: percentiles of every phase and of the whole frame in ms, rows are PERCENTILES and max, columns are
+                 PHASES and total
+        """
+        times = self.times[0:min(self.frames, len(self.times))]
+        if len(times) == 0:
+            return np.zeros((len(FrameProfiler.PERCENTILES) + 1, len(FrameProfiler.PHASES) + 1))
+        times = np.column_stack((times, times.sum(axis=1))) / 10 ** 6
+        return np.vstack((np.percentile(times, FrameProfiler.PERCENTILES, axis=0), times.max(axis=0)))
+
+    def report(self):
+        stats = self.percentiles()
+        labels = ["p%s" % p for p in FrameProfiler.PERCENTILES] + ["max"]
+        print("Frame phases in ms over the last %s frames:" % min(self.frames, len(self.times)))
+        print("      " + "".join("%9s" % phase for phase in FrameProfiler.PHASES + ["total"]))
+        for label, row in zip(labels, stats):
+            print("%-6s" % label + "".join("%9.3f" % t for t in row))
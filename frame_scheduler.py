@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+import bisect
+import time
+
+
+class FrameScheduler:
+    """
+    Keeps the frames on absolute deadlines, frame n is due at start + n * frame_time, so the time spent rendering
+    does not add up and the period does not drift. When the frame is late by more than the whole frame time, the
+    frames that cannot be shown on time are skipped. The lateness of every frame is counted in a histogram.
+    """
+    LATENESS_BINS = [0, 1, 2, 5, 10, 20, 50, 100]  # upper bounds in ms, the last bin is for the rest
+
+    def __init__(self, frame_time_ms, report_frames=0):
+        """
+        :param frame_time_ms: desired time per frame, 0 to render as fast as possible
+        :param report_frames: print the statistics every report_frames frames, 0 for never
+        """
+        self.frame_time = int(frame_time_ms * 10 ** 6)
+        self.report_frames = report_frames
+        self.start = None
+        self.histogram = [0] * (len(FrameScheduler.LATENESS_BINS) + 1)
+        self.max_lateness = 0
+        self.frames = 0
+        self.dropped = 0
+        self.report_time = 0
+        self.report_dropped = 0
+
+    def wait_next(self, frame: int) -> int:
+        """
+        Waits for the deadline of the frame after the given one
+        :param frame: the last frame shown
+        :return: the number of the frame to render, higher than frame + 1 if some frames were skipped
+        """
+        frame += 1
+        now = time.monotonic_ns()
+        if self.start is None:
+            self.start = now - frame * self.frame_time
+            self.report_time = now
+        if self.frame_time == 0:
+            self.record(frame, 0, now)
+            return frame
+        deadline = self.start + frame * self.frame_time
+        if now < deadline:
+            time.sleep((deadline - now) / 10 ** 9)
+            now = time.monotonic_ns()
+        elif now - deadline >= self.frame_time:
+            skip = (now - deadline) // self.frame_time
+            frame += skip
+            deadline += skip * self.frame_time
+            self.dropped += skip
+        self.record(frame, (now - deadline) / 10 ** 6, now)
+        return frame
+
+    def record(self, frame, lateness_ms, now):
+        self.histogram[bisect.bisect_left(FrameScheduler.LATENESS_BINS, lateness_ms)] += 1
+        self.max_lateness = max(self.max_lateness, lateness_ms)
+        self.frames += 1
+        if self.report_frames > 0 and self.frames % self.report_frames == 0:
+            fps = self.report_frames / (now - self.report_time) * (10 ** 9)
+            print("FPS: %.1f, frame %s, dropped %s (total %s), max lateness %.1f ms, lateness histogram: %s" %
+                  (fps, frame, self.dropped - self.report_dropped, self.dropped, self.max_lateness,
+                   self.format_histogram()))
+            self.report_time = now
+            self.report_dropped = self.dropped
+
+    def format_histogram(self) -> str:
+        labels = ["<=%s" % b for b in FrameScheduler.LATENESS_BINS] + [">%s" % FrameScheduler.LATENESS_BINS[-1]]
+        return ", ".join("%s: %s" % (label, count) for label, count in zip(labels, self.histogram) if count > 0)
@@ -2,7 +2,13 @@
 import base64
 import random
 from datetime import datetime, timedelta
-from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http import HTTPStatus
+import asyncio
+import gzip
+import hashlib
+import io
+import mimetypes
+import time
 import socket
 import argparse
 import logging
@@ -11,8 +17,9 @@ import sys
 import os
 import os.path
 import re
+from math import ceil, sqrt
 import zmq
-from typing import Dict, List, Union, TypedDict
+from typing import Callable, Dict, List, Tuple, Union, TypedDict
 
 from PIL import Image as pillowImg
 import numpy as np
@@ -295,20 +302,284 @@ class SaveInfo(TypedDict):
     result: str
 
 
-class LEDHttpServerClass(ThreadingHTTPServer):
-    broadcaster: zmq.Socket
+class StaticFile:
+    """
+    Content of a file from the http folder kept in memory, with the gzipped variant if it is worth it
+    """
+    GZIP_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "image/vnd.microsoft.icon")
+    GZIP_MIN_SIZE = 256
+
+    def __init__(self, file_name: str):
+        stat = os.stat(file_name)
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.checked = time.monotonic()
+        with open(file_name, "rb") as f:
+            self.content = f.read()
+        content_type, _ = mimetypes.guess_type(file_name)
+        if content_type is None:
+            content_type = "application/octet-stream"
+        self.gzipped = None
+        if len(self.content) >= StaticFile.GZIP_MIN_SIZE and content_type.startswith(StaticFile.GZIP_TYPES):
+            gzipped = gzip.compress(self.content, 9, mtime=0)
+            if len(gzipped) < len(self.content):
+                self.gzipped = gzipped
+        if content_type.startswith("text/"):
+            content_type += "; charset=UTF-8"
+        self.content_type = content_type
+        self.etag = '"%s"' % hashlib.sha1(self.content).hexdigest()[0:20]
+        # strong ETag must differ for the gzipped representation
+        self.etag_gzip = self.etag[0:-1] + '-gz"'
+
+
+class StaticFiles:
+    """
+    All files of the http folder loaded at start. A file is read again when its modification time changes, the time
+    is checked at most every CHECK_INTERVAL seconds, so that a burst of requests does not touch the disk
+    """
+    CHECK_INTERVAL = 2.0
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.files: Dict[str, StaticFile] = {}
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                file_name = os.path.join(folder, name)
+                self.files[file_name] = StaticFile(file_name)
+        logger.info("Loaded %s static files, %s bytes" % (len(self.files), sum(f.size for f in self.files.values())))
+
+    def get(self, path: str) -> Union[StaticFile, None]:
+        """
+        :param path: URL path without the query
+        :return: the file, None if it does not exist or it is outside of the root folder
+        """
+        file_name = os.path.normpath(os.path.join(self.root, path.lstrip("/")))
+        if not file_name.startswith(self.root + os.sep):
+            return None
+        cached = self.files.get(file_name)
+        now = time.monotonic()
+        if cached is not None and now - cached.checked < StaticFiles.CHECK_INTERVAL:
+            return cached
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            self.files.pop(file_name, None)
+            return None
+        if cached is None or stat.st_mtime_ns != cached.mtime or stat.st_size != cached.size:
+            if not os.path.isfile(file_name):
+                return None
+            cached = StaticFile(file_name)
+            self.files[file_name] = cached
+        cached.checked = now
+        return cached
+
+
+class PageTemplate:
+    """
+    HTML page with slots {{name}}. The page is split to the static chunks and the slots once, the page is then
+    joined from the chunks and the values of the slots. The page comes from the static files, so it is parsed again
+    when the file changes. The slots without value are left as they are
+    """
+    SLOT = re.compile(rb"{{(\w+)}}")
+
+    def __init__(self, static_files: StaticFiles, path: str):
+        self.static_files = static_files
+        self.path = path
+        self.source = None
+        self.parts: List[bytes] = []  # static chunks at even indices, slot names at odd indices
+
+    def render(self, values: Dict[str, bytes]) -> bytes:
+        static_file = self.static_files.get(self.path)
+        if static_file is None:
+            raise FileNotFoundError("Template %s not found" % self.path)
+        if static_file is not self.source:
+            self.parts = PageTemplate.SLOT.split(static_file.content)
+            self.source = static_file
+        return b"".join(part if i % 2 == 0 else values.get(part.decode(), b"{{" + part + b"}}")
+                        for i, part in enumerate(self.parts))
+
+
+class CoalescingBroadcaster:
+    """
+    Sends the messages to the controller. The state updates (send_state) are kept for the window and only the
+    latest one of every kind is sent, so the controller does not process the states that were already replaced.
+    The other messages (send_string), e.g. keyframe commands, are sent at once and in order, the pending states
+    are sent before them, so that they keep their order
+    """
+    def __init__(self, socket: zmq.Socket, window: float):
+        """
+        :param socket: the PUB socket
+        :param window: seconds the state updates are collected for, 0 sends them at once
+        """
+        self.socket = socket
+        self.window = window
+        self.pending: Dict[str, str] = {}
+        self.flush_handle: Union[asyncio.TimerHandle, None] = None
+        self.start_time = time.monotonic()
+        self.states = 0  # state updates received
+        self.coalesced = 0  # state updates replaced by newer ones before they were sent
+        self.ordered = 0  # messages sent in order
+        self.sent = 0  # all messages sent
+        self.flushes = 0
+        self.max_pending = 0
+        self.rate_time = self.start_time
+        self.rate_sent = 0
+        self.rate = 0.0  # messages per second in the last full second
+
+    def send_state(self, kind: str, msg: str):
+        """
+        :param kind: the newer state replaces the pending state of the same kind
+        :param msg: the message
+        """
+        self.states += 1
+        if kind in self.pending:
+            self.coalesced += 1
+            del self.pending[kind]  # the newest state goes to the end, after the states that came before it
+        self.pending[kind] = msg
+        self.max_pending = max(self.max_pending, len(self.pending))
+        if self.window <= 0:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def send_string(self, msg: str):
+        self.flush()
+        self.ordered += 1
+        self.send(msg)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if len(self.pending) == 0:
+            return
+        self.flushes += 1
+        for msg in self.pending.values():
+            self.send(msg)
+            logger.info("ZMQ message sent: %s" % msg)
+        self.pending = {}
+
+    def send(self, msg: str):
+        self.socket.send_string(msg)
+        self.sent += 1
+        self.update_rate()
+
+    def update_rate(self):
+        now = time.monotonic()
+        if now - self.rate_time >= 1.0:
+            self.rate = (self.sent - self.rate_sent) / (now - self.rate_time)
+            self.rate_time = now
+            self.rate_sent = self.sent
+
+    def get_stats(self) -> Dict[str, Union[int, float]]:
+        self.update_rate()
+        return {
+            "uptime": time.monotonic() - self.start_time,
+            "window": self.window,
+            "states": self.states,
+            "coalesced": self.coalesced,
+            "ordered": self.ordered,
+            "sent": self.sent,
+            "flushes": self.flushes,
+            "pending": len(self.pending),
+            "max_pending": self.max_pending,
+            "rate": self.rate
+        }
+
+
+class LEDHttpServerClass:
+    """
+    State shared by all requests
+    """
+    broadcaster: CoalescingBroadcaster
     config_path: str
     state: Dict[str, str]
-    paint_state: Dict[str, bytearray]
+    paint_state: Dict[str, np.ndarray]  # "leds" and the last state of every client, arrays of shape (N_LEDS, 3)
     kf_state: KeyFrameState
     polybiusSquare: PolybiusSquare
+    static_files: StaticFiles
+    index_template: PageTemplate
+    sys_info: Union[bytes, None]  # sampled by the server every SYS_INFO_INTERVAL
+    state_json: Tuple[Tuple, bytes]  # the last state and its json
 
 
-class LEDHttpHandler(BaseHTTPRequestHandler):
+class LEDHttpHandler:
+    """
+    One request. The handler methods write the body to wfile, the response is sent by the server when the handler
+    returns, with Content-Length, so that the connection can be kept alive.
+    The handlers are chosen by ROUTES, the first matching route wins
+    """
 
     server: LEDHttpServerClass
+    PAINT_RECORD = np.dtype([("led", "<u2"), ("rgb", np.uint8, 3)])
     save_names = {"Sunshine": "nature", "Mountain": "nature", "Ocean": "nature", "Butterfly": "nature", "Rainbow": "nature", "Garden": "nature", "Stream": "nature", "Bird": "nature", "Breeze": "nature", "Orchard": "nature", "Star": "nature", "Meadow": "nature", "Forest": "nature", "Beach": "nature", "Valley": "nature", "Flower": "nature", "Hill": "nature", "Glacier": "nature", "Waterfall": "nature", "River": "nature", "Balloon": "object", "Sunrise": "nature", "Sunset": "nature", "Fountain": "object", "Park": "nature", "Raindrop": "nature", "Rainforest": "nature", "Puppy": "animal", "Kitten": "animal", "Book": "object", "Bridge": "object", "Fireplace": "object", "Lighthouse": "object", "Sandbox": "object", "VanGogh": "painter", "Rembrandt": "painter", "DaVinci": "painter", "Michelangelo": "painter", "Picasso": "painter", "Monet": "painter", "Dali": "painter", "Cezanne": "painter", "Raphael": "painter", "Titian": "painter", "Caravaggio": "painter", "Vermeer": "painter", "Hokusai": "painter", "Goya": "painter", "Turner": "painter", "Constable": "painter", "Rodin": "painter", "Klimt": "painter", "Manet": "painter", "Matisse": "painter", "Renoir": "painter", "Degas": "painter", "Botticelli": "painter", "Bruegel": "painter", "ElGreco": "painter", "Gauguin": "painter", "Magritte": "painter", "Pillow": "object", "Cushion": "object", "Blanket": "object", "Quilt": "object", "Mug": "object", "Sweater": "object", "Scarf": "object", "Firework": "object", "Lantern": "object", "Candle": "object", "Gift": "object", "Snowflake": "nature", "Reindeer": "animal", "Sleigh": "object", "Ornament": "object", "Mistletoe": "nature", "Gingerbread": "food", "Chocolate": "food", "Eggnog": "food", "Bell": "object", "Carols": "music", "Snowman": "nature", "Ice": "nature", "Ski": "object", "Snowboard": "object", "Pinecone": "nature", "Holly": "nature", "Tinsel": "object", "Cherry": "fruit", "Strawberry": "fruit", "Apple": "fruit", "Pear": "fruit", "Peach": "fruit", "Banana": "fruit", "Blueberry": "fruit", "Raspberry": "fruit", "Blackberry": "fruit", "Pineapple": "fruit", "Coconut": "fruit", "Lemon": "fruit", "Orange": "fruit", "Melon": "fruit", "Apricot": "fruit", "Fig": "fruit", "Plum": "fruit", "Guitar": "music", "Piano": "music", "Violin": "music", "Flute": "music", "Saxophone": "music", "Trumpet": "music", "Lion": "animal", "Giraffe": "animal"}
 
+    def __init__(self, server: LEDHttpServerClass, command: str, path: str, headers: Dict[str, str], body: bytes,
+                 client_address: Tuple[str, int]):
+        """
+        :param headers: request headers, the names are lower case
+        """
+        self.server = server
+        self.command = command
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.client_address = client_address
+        self.wfile = io.BytesIO()
+        self.status = HTTPStatus.OK
+        self.response_headers: Dict[str, str] = {}
+
+    def send_response(self, status: int):
+        self.status = HTTPStatus(status)
+
+    def send_header(self, name: str, value: str):
+        self.response_headers[name] = value
+
+    def log_error(self, message: str):
+        logger.error(message)
+
+    def handle(self):
+        for methods, path, exact, handler in LEDHttpHandler.ROUTES:
+            if self.path == path if exact else self.path.startswith(path):
+                if self.command not in methods:
+                    self.send_response(HTTPStatus.METHOD_NOT_ALLOWED)
+                    self.send_header("Allow", ", ".join(methods))
+                    return
+                self.send_header("Content-Type", self.guess_content_type())
+                try:
+                    handler(self)
+                except Exception:
+                    logger.exception("Error serving %s %s" % (self.command, self.path))
+                    self.send_response(HTTPStatus.INTERNAL_SERVER_ERROR)
+                    self.wfile = io.BytesIO()
+                return
+        self.send_response(HTTPStatus.NOT_FOUND)
+
+    def get_response(self, keep_alive: bool) -> bytes:
+        body = self.wfile.getvalue()
+        head = ["HTTP/1.1 %d %s" % (self.status, self.status.phrase)]
+        head.extend("%s: %s" % header for header in self.response_headers.items())
+        if self.status != HTTPStatus.NOT_MODIFIED:
+            head.append("Content-Length: %d" % len(body))
+        head.append("Connection: %s" % ("keep-alive" if keep_alive else "close"))
+        return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+    @staticmethod
+    def error_response(status: int) -> bytes:
+        status = HTTPStatus(status)
+        body = status.phrase.encode()
+        return ("HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" %
+                (status, status.phrase, len(body))).encode("latin-1") + body
+
+    def guess_content_type(self) -> str:
+        if len(self.path) > 3 and self.path[-2:] == 'js':
+            return "text/javascript; charset=UTF-8"
+        elif len(self.path) > 4 and self.path[-3:] == 'svg':
+            return "image/svg+xml"
+        elif len(self.path) > 4 and self.path[-3:] == 'png':
+            return "image/png"
+        return "text/html; charset=UTF-8"
+
     def split_arguments(self) -> Dict[str, Union[str, None]]:
         result: Dict[str, Union[str, None]] = {}
         parts = self.path.split("?")
@@ -328,14 +599,14 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
         return result
 
     def serve_index(self):
-        f = open('http/index.html', 'r', encoding="utf-8")
-        s = f.read()
-        if sys.platform == "linux":
-            systeminfo = LEDHttpHandler.get_sys_info()
-            # print(systeminfo)
-            s = s.replace("{{systeminfo}}", systeminfo)
-        s = s.replace("{{state}}", json.dumps(self.server.state))
-        self.wfile.write(s.encode())
+        # the page is put together from memory, the system info is sampled by the server in the background
+        state_key = tuple(self.server.state.items())
+        if self.server.state_json[0] != state_key:
+            self.server.state_json = (state_key, json.dumps(self.server.state).encode())
+        values = {"state": self.server.state_json[1]}
+        if self.server.sys_info is not None:
+            values["systeminfo"] = self.server.sys_info
+        self.wfile.write(self.server.index_template.render(values))
 
     def change_source(self):
         payload = (self.path[len("/source/"):]).upper()
@@ -361,9 +632,12 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
 
     def serve_paint(self):
         """
-        If parameter state was specified, we will do diff with the last state from the same client
-        and update the "leds" state with the diff.
-        In any case, we will send back the current state of leds
+        The state of the client is diffed with the last state from the same client and only the LEDs the client
+        changed are updated in the "leds" state. In any case, we will send back the current state of leds.
+        GET: the state is in parameter state, base64 encoded, the response is json with base64 encoded state.
+        POST: the state is the body, either RGB bytes of all LEDs (format=raw, default) or only the changed LEDs as
+        records of LED index (uint16 little endian) and RGB bytes (format=sparse), the sparse records are applied
+        as they are. The response is RGB bytes of all LEDs.
         :return:
         """
         if self.server.state["source"] != "paint":
@@ -372,22 +646,58 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
         qq = self.split_arguments()
         client = self.client_address[0]
         if client not in self.server.paint_state:
-            self.server.paint_state[client] = bytearray(3 * N_LEDS)
-        if "state" in qq:
-            state: bytes = base64.b64decode(qq["state"])
-            for led in range(N_LEDS):
-                if state[3 * led + 0] != self.server.paint_state[client][3 * led + 0] or \
-                   state[3 * led + 1] != self.server.paint_state[client][3 * led + 1] or \
-                   state[3 * led + 2] != self.server.paint_state[client][3 * led + 2]:
-                    self.server.paint_state["leds"][3 * led + 0] = state[3 * led + 0]
-                    self.server.paint_state["leds"][3 * led + 1] = state[3 * led + 1]
-                    self.server.paint_state["leds"][3 * led + 2] = state[3 * led + 2]
-        self.server.paint_state[client] = bytearray(self.server.paint_state["leds"])
-        base64_state = base64.b64encode(self.server.paint_state["leds"]).decode(encoding="utf-8")
-        msg = "LED MSG set?%s" % base64_state
-        self.server.broadcaster.send_string(msg)
-        logger.info("ZMQ message sent: %s" % msg)
-        self.wfile.write(json.dumps({"result": "ok", "state": base64_state}).encode())
+            self.server.paint_state[client] = np.zeros((N_LEDS, 3), dtype=np.uint8)
+        error = None
+        if self.command == "POST":
+            if qq.get("format") == "sparse":
+                error = self.merge_paint_sparse(self.body)
+            else:
+                error = self.merge_paint(client, self.body)
+        elif "state" in qq:
+            try:
+                error = self.merge_paint(client, base64.b64decode(qq["state"]))
+            except ValueError:
+                error = "Invalid base64 state"
+        if error is not None:
+            self.send_response(HTTPStatus.BAD_REQUEST)
+            self.wfile.write(json.dumps({"result": "error", "error": error}).encode())
+            return
+        leds = self.server.paint_state["leds"]
+        self.server.paint_state[client] = leds.copy()
+        base64_state = base64.b64encode(leds.tobytes()).decode(encoding="utf-8")
+        # several clients may paint within one frame, only the latest state is sent
+        self.server.broadcaster.send_state("paint", "LED MSG set?%s" % base64_state)
+        if self.command == "POST":
+            self.send_header("Content-Type", "application/octet-stream")
+            self.wfile.write(leds.tobytes())
+        else:
+            self.wfile.write(json.dumps({"result": "ok", "state": base64_state}).encode())
+
+    def merge_paint(self, client: str, data: bytes) -> Union[str, None]:
+        """
+        Copies the LEDs that differ from the last state of the client to the "leds" state
+        :param data: RGB bytes of all LEDs
+        :return: error message, None if ok
+        """
+        if len(data) != 3 * N_LEDS:
+            return "State has %s bytes, expected %s" % (len(data), 3 * N_LEDS)
+        state = np.frombuffer(data, dtype=np.uint8).reshape(N_LEDS, 3)
+        changed = np.any(state != self.server.paint_state[client], axis=1)
+        self.server.paint_state["leds"][changed] = state[changed]
+        return None
+
+    def merge_paint_sparse(self, data: bytes) -> Union[str, None]:
+        """
+        :param data: records of LED index (uint16 little endian) and RGB bytes
+        :return: error message, None if ok
+        """
+        if len(data) % LEDHttpHandler.PAINT_RECORD.itemsize != 0:
+            return "Sparse state must be %s bytes per LED" % LEDHttpHandler.PAINT_RECORD.itemsize
+        records = np.frombuffer(data, dtype=LEDHttpHandler.PAINT_RECORD)
+        if np.any(records["led"] >= N_LEDS):
+            return "LED index out of range, there are %s LEDs" % N_LEDS
+        self.server.paint_state["leds"][records["led"]] = records["rgb"]
+        return None
 
     def keyframes_process_command(self, qq: Dict[str, str]) -> str:
         """
@@ -560,18 +870,34 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
                 logger.info("ZMQ message sent: LED RELOAD COLOR")
             self.wfile.write(s.encode())
 
-    def serve_file(self, is_binary):
-        file_name = "http%s" % self.path
-        if os.path.exists(file_name):
-            if is_binary:
-                f = open(file_name, 'rb')
-                self.wfile.write(f.read())
-            else:
-                f = open(file_name, 'r', encoding="utf-8")
-                self.wfile.write(f.read().encode())
-        else:
+    def serve_file(self):
+        """
+        Files from the memory cache, gzipped if the client accepts it, 304 if the client has the same version
+        """
+        path = self.path.split("?")[0]
+        static_file = self.server.static_files.get(path)
+        if static_file is None:
+            self.send_response(HTTPStatus.NOT_FOUND)
             self.wfile.write("FILE NOT FOUND".encode())
-            logger.warning("File not found: %s" % file_name)
+            logger.warning("File not found: http%s" % path)
+            return
+        use_gzip = static_file.gzipped is not None and "gzip" in self.headers.get("accept-encoding", "")
+        etag = static_file.etag_gzip if use_gzip else static_file.etag
+        self.send_header("Content-Type", static_file.content_type)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        if static_file.gzipped is not None:
+            self.send_header("Vary", "Accept-Encoding")
+        if_none_match = self.headers.get("if-none-match")
+        if if_none_match is not None and (if_none_match.strip() == "*" or
+                                          etag in [tag.strip() for tag in if_none_match.split(",")]):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            return
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+            self.wfile.write(static_file.gzipped)
+        else:
+            self.wfile.write(static_file.content)
 
     def get_save_names(self, folder_name, n):
         """
@@ -646,6 +972,12 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
         result["result"] = "ok"
         self.wfile.write(json.dumps(result).encode())
 
+    def serve_stats(self):
+        stats = self.server.broadcaster.get_stats()
+        stats["result"] = "ok"
+        self.send_header("Content-Type", "application/json")
+        self.wfile.write(json.dumps(stats).encode())
+
     def serve_save(self):
         """
         Valid inputs:
@@ -664,50 +996,14 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
         else:
             self.wfile.write(('{"result":"error", "reason":"Unknown save command or missing parameters %s"}' % self.path).encode())
 
-    def do_GET(self):
-        # Send headers
-        self.send_response(200)
-        is_binary = False
-        if len(self.path) > 3 and self.path[-2:] == 'js':
-            self.send_header("Content-Type", "text/javascript; charset=UTF-8")
-        elif len(self.path) > 4 and self.path[-3:] == 'svg':
-            self.send_header("Content-Type", "image/svg+xml")
-        elif len(self.path) > 4 and self.path[-3:] == 'png':
-            self.send_header("Content-Type", "image/png")
-            is_binary = True
-        else:
-            self.send_header("Content-Type", "text/html; charset=UTF-8")
-        self.end_headers()
-
-        # Serve requests
-        if self.path == "/favicon.ico":
-            f = open("http/favicon.ico", 'rb')
-            self.wfile.write(f.read())
-        elif self.path == "/":
-            self.serve_index()
-        elif self.path[0:7] == "/source":
-            self.change_source()
-        elif self.path[0:4] == "/msg":
-            self.send_message()
-        elif self.path[0:7] == "/config":
-            self.serve_config()
-        elif self.path[0:5] == "/save":
-            self.serve_save()
-        elif self.path[0:6] == "/paint":
-            self.serve_paint()
-        elif self.path[0:3] == "/kf":
-            self.serve_keyframes()
-        else:
-            self.serve_file(is_binary)
-
     @staticmethod
     def get_sys_info():
-        fproc = open("/proc/loadavg")
-        proc = fproc.readline().split(" ")
+        with open("/proc/loadavg") as fproc:
+            proc = fproc.readline().split(" ")
         proc_info = "<tr><td>CPU Load:</td>"
         proc_info += "<td>" + "</td><td>".join(proc[0:3]) + "</td></tr>\n"
-        ftemp = open("/sys/class/thermal/thermal_zone0/temp")
-        temp_info = "<tr><td colspan=4>CPU temperature: %s°C</td></tr>\n" % (int(ftemp.readline()) / 1000)
+        with open("/sys/class/thermal/thermal_zone0/temp") as ftemp:
+            temp_info = "<tr><td colspan=4>CPU temperature: %s°C</td></tr>\n" % (int(ftemp.readline()) / 1000)
         return "<table>\n" + proc_info + temp_info + "</table>\n"
 
     @staticmethod
@@ -843,13 +1139,29 @@ class LEDHttpHandler(BaseHTTPRequestHandler):
             fc2.writelines(out_lines)
         return {"result": "ok"}
 
+    # (methods, path, exact match or prefix, handler)
+    ROUTES: List[Tuple[Tuple[str, ...], str, bool, Callable[["LEDHttpHandler"], None]]] = [
+        (("GET",), "/", True, serve_index),
+        (("GET",), "/source", False, change_source),
+        (("GET",), "/msg", False, send_message),
+        (("GET",), "/config", False, serve_config),
+        (("GET",), "/save", False, serve_save),
+        (("GET", "POST"), "/paint", False, serve_paint),
+        (("GET",), "/kf", False, serve_keyframes),
+        (("GET",), "/stats", True, serve_stats),
+        (("GET",), "/", False, serve_file),
+    ]
+
 
 class LEDHttpServer:
 
     serverIP = ""
     serverPort = 80
-    timeout = 0.1
+    keep_alive_timeout = 30  # seconds, idle connections are closed after this time
+    sys_info_interval = 5  # seconds between the samples of the CPU load and temperature
+    max_body = 1024 * 1024  # bytes
     zmqPort = "tcp://*:5556"
+    coalesce_window = 0.05  # seconds the paint states are collected for before the latest one is sent
 
     def get_IP_address(self):
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -863,18 +1175,101 @@ class LEDHttpServer:
         else:
             LEDHttpServer.serverIP = self.get_IP_address()
         logger.info("Server address: %s" % LEDHttpServer.serverIP)
-        self.server = LEDHttpServerClass((LEDHttpServer.serverIP, LEDHttpServer.serverPort), LEDHttpHandler)
-        self.server.timeout = LEDHttpServer.timeout
+        self.server = LEDHttpServerClass()
         self.server.config_path = args.config_path
-        logger.warning("Threading HTTP server running")
+        self.server.sys_info = None
+        self.server.state_json = ((), b"")
+        self.sys_info_task = None
+
+    async def tick_sys_info(self):
+        failed = False
+        while True:
+            try:
+                self.server.sys_info = LEDHttpHandler.get_sys_info().encode()
+                failed = False
+            except (OSError, ValueError) as e:
+                if not failed:
+                    logger.warning("Cannot read system info: %s" % e)
+                failed = True
+            await asyncio.sleep(LEDHttpServer.sys_info_interval)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves the requests of one connection one after another until the client closes it, asks to close it or
+        it is idle for keep_alive_timeout
+        """
+        client_address = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), LEDHttpServer.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                request = line.decode("latin-1").split()
+                if len(request) != 3:
+                    writer.write(LEDHttpHandler.error_response(HTTPStatus.BAD_REQUEST))
+                    break
+                command, path, version = request
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0 or "chunked" in headers.get("transfer-encoding", ""):
+                    writer.write(LEDHttpHandler.error_response(HTTPStatus.BAD_REQUEST))
+                    break
+                if length > LEDHttpServer.max_body:
+                    writer.write(LEDHttpHandler.error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE))
+                    break
+                if length > 0 and headers.get("expect", "").lower() == "100-continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                body = await reader.readexactly(length) if length > 0 else b""
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                handler = LEDHttpHandler(self.server, command, path, headers, body, client_address)
+                handler.handle()
+                writer.write(handler.get_response(keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        http_server = await asyncio.start_server(self.handle_connection, LEDHttpServer.serverIP,
+                                                 LEDHttpServer.serverPort)
+        logger.warning("HTTP server running")
+        # the loop keeps only weak references to the tasks
+        if sys.platform == "linux":
+            self.sys_info_task = asyncio.create_task(self.tick_sys_info())
+        try:
+            async with http_server:
+                await http_server.serve_forever()
+        finally:
+            if self.sys_info_task is not None:
+                self.sys_info_task.cancel()
+                self.sys_info_task = None
 
     def start(self):
         context = zmq.Context()
-        self.server.broadcaster = context.socket(zmq.PUB)
-        self.server.broadcaster.bind(LEDHttpServer.zmqPort)
+        pub_socket = context.socket(zmq.PUB)
+        pub_socket.bind(LEDHttpServer.zmqPort)
+        self.server.broadcaster = CoalescingBroadcaster(pub_socket, LEDHttpServer.coalesce_window)
         self.server.state = {"source": "embers", "color": "#FFFFFF", "mode": ""}
-        self.server.paint_state = {"leds": bytearray(3 * N_LEDS)}
+        self.server.paint_state = {"leds": np.zeros((N_LEDS, 3), dtype=np.uint8)}
         self.server.kf_state = KeyFrameState()
+        self.server.static_files = StaticFiles("http")
+        self.server.index_template = PageTemplate(self.server.static_files, "/index.html")
         self.server.polybiusSquare = PolybiusSquare([
             ['A', 'B', 'C', 'D', 'E'],
             ['F', 'G', 'H', 'X', 'I'],  # "Ch" replaced with "X"
@@ -890,12 +1285,11 @@ class LEDHttpServer:
         ])
 
         try:
-            while True:
-                self.server.handle_request()
+            asyncio.run(self.serve())
         except:
             print(sys.exc_info())
             logger.fatal(sys.exc_info())
-        logger.warning("Threading HTTP server terminating")
+        logger.warning("HTTP server terminating")
 
 
 if __name__ == "__main__":
@@ -905,7 +1299,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='HTTP server for controlling LEDs')
     parser.add_argument("-i", "--ip", help='IP address', default="default", type=str)
     parser.add_argument("-c", "--config_path", help="Controller config path", default="d:\\code\\C++\\filter_test\\LED_controller\\config", type=str)
+    parser.add_argument("-n", "--leds", help="Number of LEDs", default=N_LEDS, type=int)
+    parser.add_argument("-w", "--window", help="Milliseconds the paint states are collected for, only the latest "
+                                               "one is sent to the controller", default=50, type=float)
     args = parser.parse_args()
+    LEDHttpServer.coalesce_window = args.window / 1000
+    N_LEDS = args.leds
+    N_THUMB_SIZE = max(N_THUMB_SIZE, ceil(sqrt(N_LEDS)))  # the saves are square images
     server = LEDHttpServer(args)
     print("Serving on IP %s" % server.serverIP)
     server.start()
@@ -0,0 +1,103 @@
+#! /usr/bin/python
+
+from basic_source import BasicSource
+from math import ceil
+import numpy as np
+import time
+
+
+class KeyframeSource(BasicSource):
+    """
+    Wraps a source that changes smoothly, renders it only every k frames and interpolates the frames in between,
+    either the gradient indices (INDEX) or the colors (RGB). The keyframe after the frame has to be rendered first,
+    so the source runs up to k frames ahead of the output.
+    k adapts to the time the keyframes take, so that the average time per frame stays within the budget.
+    """
+    SPACES = ["INDEX", "RGB"]
+    COST_SMOOTHING = 0.2  # weight of the last keyframe in the average render time
+
+    def __init__(self, source: BasicSource, max_k: int = 8, budget_ms: float = 5, space: str = "INDEX"):
+        """
+        :param source: the source to interpolate
+        :param max_k: the longest distance of the keyframes
+        :param budget_ms: desired render time per frame, k is the average time per keyframe divided by it
+        :param space: what is interpolated, INDEX for the sources with gradients, RGB for any source. RGB is used
+        for the sources that render only colors
+        """
+        if space not in KeyframeSource.SPACES:
+            raise ValueError("Unknown interpolation space %s, use one of %s" %
+                             (space, ", ".join(KeyframeSource.SPACES)))
+        if space == "INDEX" and source.rgb_only:
+            print("Source %s renders only colors, keyframes will be interpolated in RGB" % type(source).__name__)
+            space = "RGB"
+        super().__init__(source.time_speed, source.output_type)
+        self.rgb_only = space == "RGB"
+        self.source = source
+        self.max_k = max_k
+        self.budget = budget_ms / 1000
+        self.space = space
+        self.k = 1
+        self.cost = 0.0
+        self.rendered = 0  # last frame the source was advanced to
+        self.prev_frame = None
+        self.prev = None
+        self.next_frame = None
+        self.next = None
+
+    def get_colors(self):
+        return self.source.get_colors()
+
+    def init(self, n_led):
+        self.nLed = n_led
+        self.source.init(n_led)
+        self.share_gradient(self.source)
+
+    def render_key(self, frame: int) -> np.ndarray:
+        start = time.perf_counter()
+        for skipped in range(self.rendered + 1, frame):
+            self.source.advance(skipped)
+        if self.space == "INDEX":
+            key = self.source.render_frame(frame).astype(np.float32)
+        else:
+            key = self.source.render_rgb(frame).astype(np.float32)
+        self.rendered = frame
+        cost = time.perf_counter() - start
+        self.cost = KeyframeSource.COST_SMOOTHING * cost + (1 - KeyframeSource.COST_SMOOTHING) * self.cost
+        self.k = min(self.max_k, max(1, ceil(self.cost / self.budget)))
+        return key
+
+    def interpolate(self, frame: int) -> np.ndarray:
+        if self.next_frame is None or frame < self.prev_frame or frame >= self.next_frame + self.k:
+            # first frame, or too far from the keyframes (frames skipped or rendered out of order), start again
+            if frame < self.rendered:
+                print("KeyframeSource cannot go back from frame %s to %s" % (self.rendered, frame))
+            self.prev_frame = frame
+            self.prev = self.render_key(frame)
+            self.next_frame = frame + self.k
+            self.next = self.render_key(self.next_frame)
+        while frame > self.next_frame:
+            self.prev_frame, self.prev = self.next_frame, self.next
+            self.next_frame = self.prev_frame + self.k
+            self.next = self.render_key(self.next_frame)
+        t = (frame - self.prev_frame) / (self.next_frame - self.prev_frame)
+        return self.prev + (self.next - self.prev) * t
+
+    def advance(self, frame: int):
+        # the source is advanced when the next keyframe is rendered
+        pass
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        if self.space == "INDEX":
+            return np.rint(self.interpolate(frame)).astype(np.intp)
+        raise NotImplementedError("KeyframeSource interpolates colors in RGB space, use render_rgb")
+
+    def render_rgb(self, frame: int) -> np.ndarray:
+        if self.space == "INDEX":
+            return super().render_rgb(frame)
+        return (self.interpolate(frame) + 0.5).astype(np.uint8)
+
+    def update_leds(self, frame: int, strip):
+        if self.space == "INDEX":
+            super().update_leds(frame, strip)
+        else:
+            strip.write_frame(self.rgb_to_output(self.render_rgb(frame)))
@@ -5,14 +5,22 @@ from perlin_source import PerlinSource
 from fire_source import FireSource
 from color_source import ColorSource
 from morse_source import MorseSource
-import time
+from compositor import CompositorSource, Layer
+from loop_cache import LoopCacheSource
+from keyframe_source import KeyframeSource
+from render_ahead import RenderAhead
+from frame_scheduler import FrameScheduler
+from frame_profiler import FrameProfiler
+from recording import RecordStrip, ReplaySource
+from post_process import PostProcessor
+from strips import Ws281xStrip, DummyStrip
 import argparse
+import signal
 import sys
+import numpy as np
 if sys.platform != 'linux':
-    from tk_strips import TkPlot, TkStrip, DummyStrip
+    from tk_strips import TkPlot, TkStrip
     # import yappi
-else:
-    from rpi_ws281x import PixelStrip
 
 
 class App:
@@ -25,59 +33,87 @@ class App:
     LED_BRIGHTNESS = 255  # Set to 0 for darkest and 255 for brightest
     LED_INVERT = False    # True to invert the signal (when using NPN transistor level shift)
     LED_CHANNEL = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
+    LED_CHANNEL_MA = 20   # current of one color channel of one LED at full brightness in mA
+    LED_IDLE_MA = 1       # current of one LED when it is black in mA
 
     FRAME_TIME = 100       # desired time per frame in ms, fps = 1000/FRAME_TIME
-    FPS_SAMPLES = 50      # over how many samples calculate FPS
+    FPS_SAMPLES = 50      # over how many samples calculate FPS and print the frame statistics
+    PROFILE_FRAMES = 1024  # how many last frames are kept for the percentiles of the frame phases
 
-    def __init__(self, source: BasicSource, output: str):
+    def __init__(self, source: BasicSource, output: str, workers: int = 0, queue_depth: int = 8, raster: bool = False,
+                 plot_history: int = 0, record_file: str = None, profile_report: int = 0,
+                 post_process: PostProcessor = None, record_append: bool = False):
         self.output = output
         if self.output == "STRIP":
             # Create NeoPixel object with appropriate configuration.
-            self.strip = PixelStrip(App.N_LEDS, App.LED_PIN, App.LED_FREQ_HZ, App.LED_DMA, App.LED_INVERT, App.LED_BRIGHTNESS, App.LED_CHANNEL)
+            self.strip = Ws281xStrip(App.N_LEDS, App.LED_PIN, App.LED_FREQ_HZ, App.LED_DMA, App.LED_INVERT, App.LED_BRIGHTNESS, App.LED_CHANNEL)
         elif self.output == "LED":
-            self.strip = TkStrip(App.N_LEDS, self)
+            self.strip = TkStrip(App.N_LEDS, self, raster)
         elif self.output == "PLOT":
-            self.strip = TkPlot(App.N_LEDS, self)
+            self.strip = TkPlot(App.N_LEDS, self, plot_history)
         elif self.output == "DUMMY":
             self.strip = DummyStrip()
+        elif self.output == "RECORD":
+            self.strip = RecordStrip(record_file, App.N_LEDS, App.FRAME_TIME, append=record_append)
         else:
             print("Unknown output %s" % self.output)
             sys.exit(-1)
 
         self.source = source
         self.source.init(App.N_LEDS)
+        self.post_process = post_process
         self.frame = 0
-        self.last_update = time.time_ns()
-        self.fps_times = self.last_update
+        # recording is done offline, as fast as possible
+        self.scheduler = FrameScheduler(0 if self.output == "RECORD" else App.FRAME_TIME, App.FPS_SAMPLES)
+        self.profiler = FrameProfiler(App.PROFILE_FRAMES, profile_report)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, stack: self.profiler.report())
+        self.render_ahead = None
+        if workers > 0:
+            self.render_ahead = RenderAhead(self.source, self.frame + 1, workers, queue_depth)
         # Intialize the library (must be called once before other functions).
         self.strip.begin()
         self.error_time = 0
 
     def update(self):
-        current_ns = time.time_ns()
-        delta_ms = (current_ns - self.last_update) / (10 ** 6)
-        self.frame += 1
-        if self.frame % App.FPS_SAMPLES == 0:
-            fps = App.FPS_SAMPLES / (current_ns - self.fps_times) * (10 ** 9)
-            self.fps_times = current_ns
-            print("FPS: %s" % fps) #
-            # if sys.platform != 'linux' and self.frame == 1000:
-            #    yappi.get_func_stats().print_all()
-
-        sleep_time = 1
-        if delta_ms < App.FRAME_TIME:
-            sleep_time = App.FRAME_TIME - delta_ms
-        # expected_time = current_ns + sleep_time * 1000
-        time.sleep(sleep_time / 1000)
-        self.last_update = time.time_ns()
-        self.source.update_leds(self.frame, self.strip)
+        self.profiler.start()
+        frame = self.scheduler.wait_next(self.frame)
+        self.profiler.mark(0)
+        if self.render_ahead is None:
+            for skipped in range(self.frame + 1, frame):
+                self.source.advance(skipped)
+        self.profiler.mark(1)
+        self.frame = frame
+        # if sys.platform != 'linux' and self.frame == 1000:
+        #    yappi.get_func_stats().print_all()
+        self.render(self.frame)
+        self.profiler.mark(2)
         self.strip.show()
+        self.profiler.mark(3)
+        self.profiler.end()
         #print(self.frame)
 
+    def render(self, frame):
+        if self.render_ahead is not None:
+            rgb = self.render_ahead.get_frame(frame)
+        elif self.post_process is not None:
+            rgb = self.source.render_rgb(frame)
+        else:
+            self.source.update_leds(frame, self.strip)
+            return
+        if self.post_process is not None:
+            rgb = self.post_process.apply(rgb)
+        self.strip.write_frame(self.source.rgb_to_output(rgb))
+
+    def close(self):
+        if self.render_ahead is not None:
+            self.render_ahead.close()
+            self.render_ahead = None
+        self.strip.close()
+
     def turn_off_strip(self):
         if self.output == 'STRIP':
-            for i in range(App.N_LEDS):
-                self.strip.setPixelColor(i, 0)
+            self.strip.write_frame(np.zeros(App.N_LEDS, dtype=np.uint32))
             self.strip.show()
 
 
@@ -85,22 +121,69 @@ if __name__ == '__main__':
     # Process arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--clear', action='store_true', help='clear the display on exit')
-    parser.add_argument('-m', '--mode', choices=['EMBERS','PERLIN','COLOR', 'CHASER', 'MORSE'],
-                        default="MORSE", help='output mode, can be either PERLIN or EMBERS')
-    parser.add_argument('-o', '--output', choices=['STRIP', 'LED', 'PLOT', 'DUMMY'], default='LED',
-                        help='Output device, on Windows, only LED and PLOT are valid')
+    parser.add_argument('-m', '--mode', choices=['EMBERS','PERLIN','COLOR', 'CHASER', 'MORSE', 'SKYFIRE'],
+                        default="MORSE", help='output mode, can be either PERLIN or EMBERS, SKYFIRE is the fire '
+                                              'on the first third of the strip over the sky (PERLIN)')
+    parser.add_argument('-o', '--output', choices=['STRIP', 'LED', 'PLOT', 'DUMMY', 'RECORD', 'REPLAY'], default='LED',
+                        help='Output device, on Windows, only LED and PLOT are valid. RECORD writes the frames '
+                             'to --file, REPLAY plays the frames from --file to --replay-output')
     parser.add_argument('-t', '--timespeed', default=1, type=int,
                         help='Output device, on Windows, only LED and PLOT are valid')
+    parser.add_argument('-l', '--loop-cache', action='store_true',
+                        help='render one cycle of a periodic source in advance and then play it from memory')
+    parser.add_argument('--loop-cache-file', default=None,
+                        help='save the cycle to this .npy file and memory map it, used with --loop-cache')
+    parser.add_argument('-k', '--keyframes', default=0, type=int,
+                        help='render only every k-th frame and interpolate the rest, k adapts to the render time '
+                             'up to this value, 0 renders all frames')
+    parser.add_argument('--keyframe-space', choices=['INDEX', 'RGB'], default='INDEX',
+                        help='interpolate gradient indices or colors, RGB is used for the sources without '
+                             'a gradient (SKYFIRE, REPLAY)')
+    parser.add_argument('--keyframe-budget', default=5, type=float,
+                        help='desired render time per frame in ms for --keyframes')
+    parser.add_argument('-w', '--workers', default=0, type=int,
+                        help='number of processes rendering the frames ahead, 0 renders in the main loop')
+    parser.add_argument('-q', '--queue-depth', default=8, type=int,
+                        help='how many frames can the workers render ahead')
+    parser.add_argument('-r', '--raster', action='store_true',
+                        help='draw the LED output as one image, faster for thousands of LEDs')
+    parser.add_argument('-p', '--plot-history', default=0, type=int,
+                        help='show this many previous frames as lines in the PLOT output')
+    parser.add_argument('-g', '--gamma', nargs='+', default=[1.0], type=float,
+                        help='gamma correction, one value for all channels or three for R, G and B')
+    parser.add_argument('-b', '--brightness', default=1.0, type=float, help='dim the whole strip, 0 to 1')
+    parser.add_argument('--segment', nargs=3, action='append', type=float, metavar=('START', 'LENGTH', 'LEVEL'),
+                        help='dim LENGTH LEDs from START to LEVEL (0 to 1), can be repeated')
+    parser.add_argument('--max-current', default=0, type=float,
+                        help='scale the frames down when the estimated current of the strip is over this many mA')
+    parser.add_argument('-f', '--file', default='frames.ledrec', help='file for RECORD and REPLAY outputs')
+    parser.add_argument('--append', action='store_true',
+                        help='RECORD adds the frames to the end of --file, it must have the same number of LEDs')
+    parser.add_argument('--replay-realtime', action='store_true',
+                        help='REPLAY shows the frames with the frame time of the recording, not as fast as possible')
+    parser.add_argument('--replay-output', choices=['STRIP', 'LED', 'PLOT', 'DUMMY'], default='LED',
+                        help='Output device for REPLAY, on Linux it is always STRIP')
+    parser.add_argument('-n', '--frames', default=0, type=int, help='stop after this many frames, 0 never stops')
+    parser.add_argument('--profile', default=0, type=int,
+                        help='print the percentiles of the time spent waiting, rendering and showing every PROFILE '
+                             'frames, 0 only prints them on SIGUSR1')
     args = parser.parse_args()
+    if args.workers < 0:
+        parser.error("--workers must be 0 or more")
+    if args.queue_depth < 1:
+        parser.error("--queue-depth must be at least 1")
     actual_output = 'STRIP'
     output_type = "LED"
     if sys.platform != 'linux':
-        actual_output = args.output
+        actual_output = args.replay_output if args.output == "REPLAY" else args.output
         output_type = "HEX"
         if actual_output == "PLOT":
             output_type = "Y"
         # yappi.set_clock_type("cpu")
         # yappi.start()
+    if args.output == "RECORD":
+        actual_output = "RECORD"
+        output_type = "LED"
     actual_source = BasicSource(args.timespeed, output_type)
     if args.mode == "PERLIN":
         actual_source = PerlinSource(args.timespeed, output_type)
@@ -110,11 +193,34 @@ if __name__ == '__main__':
         actual_source = ColorSource(args.timespeed, output_type, ["#FF0000", "#000000", "#000000"])
     elif args.mode == "MORSE":
         actual_source = MorseSource(args.timespeed, output_type)
-    app = App(actual_source, actual_output)
-    if actual_output == 'STRIP' or actual_output == 'DUMMY':
+    elif args.mode == "SKYFIRE":
+        actual_source = CompositorSource(args.timespeed, output_type, [
+            Layer(PerlinSource(args.timespeed, output_type), App.N_LEDS // 4, blend="ALPHA", opacity=0.8),
+            Layer(FireSource(args.timespeed, output_type), 0, App.N_LEDS // 3, blend="MAX")])
+    if args.output == "REPLAY":
+        # the recording replaces the source, it can still be interpolated with -k
+        actual_source = ReplaySource(args.file, output_type)
+        App.N_LEDS = actual_source.recording.n_led
+        App.FRAME_TIME = actual_source.recording.frame_time if args.replay_realtime else 0
+    if args.loop_cache:
+        actual_source = LoopCacheSource(actual_source, args.loop_cache_file)
+    if args.keyframes > 0:
+        actual_source = KeyframeSource(actual_source, args.keyframes, args.keyframe_budget, args.keyframe_space)
+    post_process = None
+    if args.gamma != [1.0] or args.brightness != 1.0 or args.segment or args.max_current > 0:
+        if len(args.gamma) not in (1, 3):
+            parser.error("--gamma takes one or three values")
+        segments = [(int(start), int(length), level) for start, length, level in args.segment or []]
+        post_process = PostProcessor(App.N_LEDS, args.gamma, args.brightness, segments, args.max_current,
+                                     App.LED_CHANNEL_MA, App.LED_IDLE_MA)
+    app = App(actual_source, actual_output, args.workers, args.queue_depth, args.raster,
+              args.plot_history, args.file, args.profile, post_process, args.append)
+    if actual_output == 'STRIP' or actual_output == 'DUMMY' or actual_output == 'RECORD':
         try:
-            while True:
+            while args.frames == 0 or app.frame < args.frames:
                 app.update()
         except KeyboardInterrupt:
             app.turn_off_strip()
+    # the Tk outputs return here when the window is closed
+    app.close()
 
@@ -0,0 +1,102 @@
+#! /usr/bin/python
+
+from basic_source import BasicSource
+import numpy as np
+import os
+
+
+class LoopCacheSource(BasicSource):
+    """
+    Wraps a periodic source, renders one full cycle of it into a buffer and then only reads the frames from the
+    buffer. The buffer can be saved to a .npy file, which is memory mapped, so the next start does not render at all.
+    The key of the source (get_cache_key, the number of LEDs and the period) is saved next to it in a .key file and
+    the file is reused only if the key matches, so use it only for the sources that are not random.
+    If the source is not periodic, or the cycle is too long, the frames are rendered as usual.
+    """
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, source: BasicSource, file_name: str = None):
+        super().__init__(source.time_speed, source.output_type)
+        self.source = source
+        self.rgb_only = source.rgb_only
+        self.file_name = file_name
+        self.frames = None
+
+    def get_colors(self):
+        return self.source.get_colors()
+
+    def get_period(self):
+        return self.source.get_period()
+
+    def init(self, n_led):
+        self.nLed = n_led
+        self.source.init(n_led)
+        self.share_gradient(self.source)
+        if self.source.rgb_only:
+            print("Source %s renders only colors, frames will not be cached" % type(self.source).__name__)
+            return
+        period = self.source.get_period()
+        if period is None:
+            print("Source %s is not periodic, frames will not be cached" % type(self.source).__name__)
+            return
+        dtype = np.uint8 if len(self.gradient) <= 256 else np.uint16
+        if period * n_led * np.dtype(dtype).itemsize > LoopCacheSource.MAX_BYTES:
+            print("Period of %s is %s frames, too long to cache" % (type(self.source).__name__, period))
+            return
+        key = repr(self.source.get_cache_key() + (n_led, period))
+        if self.file_name is not None and os.path.exists(self.file_name):
+            if self.read_key() == key:
+                frames = np.load(self.file_name, mmap_mode="r")
+                if frames.shape == (period, n_led) and frames.dtype == dtype:
+                    self.frames = frames
+                    return
+            print("Cache file %s does not match the source, rendering again" % self.file_name)
+        self.frames = self.render_cycle(period, dtype)
+        if self.file_name is not None:
+            with open(self.file_name + ".key", "w") as f:
+                f.write(key)
+
+    def read_key(self):
+        try:
+            with open(self.file_name + ".key") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def render_cycle(self, period, dtype) -> np.ndarray:
+        if self.file_name is None:
+            frames = np.zeros((period, self.nLed), dtype=dtype)
+        else:
+            # the old key is removed first, so that an interrupted rendering is not taken for the old source
+            if os.path.exists(self.file_name + ".key"):
+                os.remove(self.file_name + ".key")
+            tmp_file = self.file_name + ".tmp.npy"
+            frames = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=dtype, shape=(period, self.nLed))
+        for frame in range(period):
+            frames[frame] = self.source.render_frame(frame)
+        if self.file_name is not None:
+            frames.flush()
+            del frames
+            os.replace(tmp_file, self.file_name)
+            frames = np.load(self.file_name, mmap_mode="r")
+        return frames
+
+    def advance(self, frame: int):
+        if self.frames is None:
+            self.source.advance(frame)
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        if self.frames is None:
+            return self.source.render_frame(frame)
+        return self.frames[frame % len(self.frames)]
+
+    def render_rgb(self, frame: int) -> np.ndarray:
+        if self.frames is None:
+            return self.source.render_rgb(frame)
+        return super().render_rgb(frame)
+
+    def update_leds(self, frame: int, strip):
+        if self.frames is None:
+            self.source.update_leds(frame, strip)
+        else:
+            super().update_leds(frame, strip)
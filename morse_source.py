@@ -1,4 +1,7 @@
 from basic_source import  BasicSource
+from functools import lru_cache
+from math import lcm
+import numpy as np
 import sys
 
 
@@ -32,45 +35,16 @@ class MorseSource(BasicSource):
     cmorse = [".-", "-...", "-.-.", "-..", ".", "..-.", "--.", "....", "..", ".---","-.-", ".-..", "--",
               "-.", "---", ".--.", "--.-", ".-.", "...", "-", "..-", "...-", ".--", "-..-", "-.--", "--.."]
 
+    frame_per_dot = 4  # blink mode
+    msg_padding = 3
+
     def __init__(self, ts, output_type):
         super().__init__(ts, output_type)
+        self._text = ""
+        self.tape = None
         self.text = "AHOJ URSULO"
-        ffont = open("font_5x7.bmp", "rb")
-        ffont.seek(0x0A)
-        buf = ffont.read(4)
-        offset = buf[0] | buf[1] << 8 | buf[2] << 16 | buf[3] << 24
-        print(offset)
-        ffont.seek(offset)
-
-        self.font = []
-        for y in range(7):
-            self.font.append([1] * MorseSource.fw * 26)
-        for y in range(7):
-            row = ffont.read((MorseSource.fw + 1) * 26)
-            column = 0
-            for x in range((MorseSource.fw + 1) * 26):
-                if x % (MorseSource.fw + 1) == MorseSource.fw:
-                    continue
-                if row[x] > 0:
-                    self.font[6-y][column] = 0
-                column += 1
-
-        self.morse = []
-        for m in MorseSource.cmorse:
-            mc = MorseChar()
-            mc.length = 0
-            for i in range(len(m)):
-                if m[i] == '-':
-                    for j in range(3):
-                        mc.data[mc.length] = 2
-                        mc.length += 1
-                else:
-                    mc.data[mc.length] = 1
-                    mc.length += 1
-                mc.data[mc.length] = 0
-                mc.length += 1
-            mc.length -= 1
-            self.morse.append(mc)
+        self.font = load_font("font_5x7.bmp")
+        self.morse = build_morse()
 
         # Debug output
         for row in self.font:
@@ -84,48 +58,24 @@ class MorseSource(BasicSource):
 
         print(self.morse)
 
-    def get_colors(self):
-        return [("#FFFFFF", 1), ("#000000", 1), ("#FF0000", 6), ("#0000FF", 1)]
+    @property
+    def text(self):
+        return self._text
 
-    def update_leds_morse(self, frame: int, strip):
-        for i in range(self.nLed):
-            y = 0
-            strip.setPixelColor(i, self.gradient[y])
-
-        # now render the text
-        offset = 1
-        msg = [0] * self.nLed
-        for index in range(len(self.text)):
-            c = self.text[index]
-            if c == " ":
-                offset += 7
-                continue
-            letter_color = (index % 6) + 2
-            code = MorseSource.cmorse[ord(c) - 65]
-            for dd in code:
-                if dd == ".":
-                    msg[offset] = letter_color
-                    offset +=2
-                if dd == "-":
-                    msg[offset] = letter_color
-                    msg[offset+1] = letter_color
-                    msg[offset+2] = letter_color
-                    offset += 4
-            offset += 3
-        offset -= 3
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self.tape = None  # it will be compiled in the next frame
 
-        mframe = frame % self.nLed
-        for i in range(len(msg)):
-            strip.setPixelColor((self.nLed + i - mframe) % self.nLed, self.gradient[msg[i]])
-        strip.setPixelColor((self.nLed - mframe) % self.nLed, self.gradient[1])
-        strip.setPixelColor((self.nLed + offset - mframe) % self.nLed, self.gradient[1])
+    def get_colors(self):
+        return [("#FFFFFF", 1), ("#000000", 1), ("#FF0000", 6), ("#0000FF", 1)]
 
     def get_gradient_index(self, led, frame):
         return self.get_gradient_index_scroll(led, frame)
 
     def get_gradient_index_blink(self, led, frame):
-        frame_per_dot = 4
-        msg_padding = 3
+        frame_per_dot = MorseSource.frame_per_dot
+        msg_padding = MorseSource.msg_padding
         shift = frame // (frame_per_dot * 16)
         led = (led + shift) % self.nLed
 
@@ -166,15 +116,172 @@ class MorseSource(BasicSource):
         # print(self.text[char_number], font_col)
         return self.font[font_row][font_column] * letter_color
 
-    def update_leds(self, frame: int, strip):
+    def get_cache_key(self):
+        return super().get_cache_key() + (self.text,)
+
+    def get_period(self):
+        # modes, morse scrolling, scroll leading and blink signal with its shift
+        return lcm(300, self.nLed, MorseSource.fh + 10, MorseSource.frame_per_dot * 16 * self.nLed)
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        if self.tape is None or self.tape.n_led != self.nLed:
+            self.tape = compile_tape(self.text, self.nLed)
         mode = (frame // 100) % 3
         if mode == 0:
-            self.update_leds_morse(frame, strip)
+            return self.tape.get_morse(frame)
         elif mode == 1:
-            for i in range(self.nLed):
-                y = self.get_gradient_index_scroll(i, frame)
-                strip.setPixelColor(i, self.gradient[y])
-        elif mode == 2:
-            for i in range(self.nLed):
-                y = self.get_gradient_index_blink(i, frame)
-                strip.setPixelColor(i, self.gradient[y])
+            return self.tape.get_scroll(frame)
+        else:
+            return self.tape.get_blink(frame)
+
+
+class MorseTape:
+    """
+    The text compiled into the frames of all modes. The frames of one mode differ only by the shift of the text, so
+    every frame is a slice of an array with two copies of the strip, the arrays are read only
+    """
+    def __init__(self, text: str, n_led: int, font: np.ndarray, morse: list):
+        self.text = text
+        self.n_led = n_led
+        self.morse = MorseTape.doubled(MorseTape.compile_morse(text, n_led))
+        self.scroll = MorseTape.compile_scroll(text, n_led, font)
+        self.blink = np.stack([MorseTape.doubled(row) for row in MorseTape.compile_blink(text, n_led, morse)])
+        for tape in (self.morse, self.scroll, self.blink):
+            tape.flags.writeable = False
+
+    @staticmethod
+    def doubled(tape: np.ndarray) -> np.ndarray:
+        return np.concatenate((tape, tape))
+
+    @staticmethod
+    def compile_morse(text: str, n_led: int) -> np.ndarray:
+        offset = 1
+        msg = np.zeros(n_led, dtype=np.intp)
+        for index in range(len(text)):
+            c = text[index]
+            if c == " ":
+                offset += 7
+                continue
+            letter_color = (index % 6) + 2
+            code = MorseSource.cmorse[ord(c) - 65]
+            for dd in code:
+                if dd == ".":
+                    msg[offset] = letter_color
+                    offset += 2
+                if dd == "-":
+                    msg[offset:offset + 3] = letter_color
+                    offset += 4
+            offset += 3
+        offset -= 3
+        # the beginning and the end of the message
+        msg[0] = 1
+        msg[offset % n_led] = 1
+        return msg
+
+    @staticmethod
+    def compile_scroll(text: str, n_led: int, font: np.ndarray) -> np.ndarray:
+        """
+        :return: array with one row per font row (including the leading), the rows are not shifted
+        """
+        leds = np.arange(n_led)
+        text_length = len(text)
+        char_number = (leds // (MorseSource.fw + 1)) % (text_length + 1)
+        font_column = leds % (MorseSource.fw + 1)
+        # the extra character after the text is the padding, it is handled below
+        is_space = np.array([c == " " for c in text] + [True])
+        codes = np.array([0 if c == " " else ord(c) - 65 for c in text] + [0])
+        letter_color = (char_number % 6) + 2
+        font_columns = codes[char_number] * MorseSource.fw + np.minimum(font_column, MorseSource.fw - 1)
+        scroll = np.zeros((MorseSource.fh + 10, n_led), dtype=np.intp)  # rows after fh are the leading
+        scroll[0:MorseSource.fh] = font[:, font_columns] * letter_color
+        scroll[:, is_space[char_number]] = 0
+        scroll[:, font_column == MorseSource.fw] = 1  # this is interspace column
+        scroll[:, char_number >= text_length] = 1
+        return scroll
+
+    @staticmethod
+    def compile_blink(text: str, n_led: int, morse: list) -> np.ndarray:
+        """
+        :return: array with one row per frame of the character signal, the rows are not shifted
+        """
+        text_length = len(text)
+        frame_per_dot = MorseSource.frame_per_dot
+        # signal of every character of the text at every frame, padding is added as spaces
+        signal = np.zeros((frame_per_dot * 16, text_length + MorseSource.msg_padding), dtype=np.intp)
+        signal[:, text_length:] = 1
+        for index, c in enumerate(text):
+            if c == " ":
+                continue
+            mc = morse[ord(c) - 65]
+            for ft in range(frame_per_dot * mc.length):
+                if mc.data[ft // frame_per_dot] > 0:
+                    signal[ft, index] = 2 + index % 6
+        return signal[:, np.arange(n_led) % (text_length + MorseSource.msg_padding)]
+
+    def get_morse(self, frame: int) -> np.ndarray:
+        mframe = frame % self.n_led
+        return self.morse[mframe:mframe + self.n_led]
+
+    def get_scroll(self, frame: int) -> np.ndarray:
+        return self.scroll[frame % (MorseSource.fh + 10)]
+
+    def get_blink(self, frame: int) -> np.ndarray:
+        shift = (frame // (MorseSource.frame_per_dot * 16)) % self.n_led
+        return self.blink[frame % (MorseSource.frame_per_dot * 16), shift:shift + self.n_led]
+
+
+@lru_cache(maxsize=None)
+def load_font(file_name: str) -> np.ndarray:
+    """
+    Reads the 5x7 font from bmp, 0 is empty pixel, 1 is the letter
+    :return: read only array with 7 rows and 5 columns per letter
+    """
+    ffont = open(file_name, "rb")
+    ffont.seek(0x0A)
+    buf = ffont.read(4)
+    offset = buf[0] | buf[1] << 8 | buf[2] << 16 | buf[3] << 24
+    print(offset)
+    ffont.seek(offset)
+
+    font = []
+    for y in range(7):
+        font.append([1] * MorseSource.fw * 26)
+    for y in range(7):
+        row = ffont.read((MorseSource.fw + 1) * 26)
+        column = 0
+        for x in range((MorseSource.fw + 1) * 26):
+            if x % (MorseSource.fw + 1) == MorseSource.fw:
+                continue
+            if row[x] > 0:
+                font[6-y][column] = 0
+            column += 1
+    ffont.close()
+    font = np.array(font, dtype=np.intp)
+    font.flags.writeable = False
+    return font
+
+
+@lru_cache(maxsize=None)
+def build_morse() -> tuple:
+    morse = []
+    for m in MorseSource.cmorse:
+        mc = MorseChar()
+        mc.length = 0
+        for i in range(len(m)):
+            if m[i] == '-':
+                for j in range(3):
+                    mc.data[mc.length] = 2
+                    mc.length += 1
+            else:
+                mc.data[mc.length] = 1
+                mc.length += 1
+            mc.data[mc.length] = 0
+            mc.length += 1
+        mc.length -= 1
+        morse.append(mc)
+    return tuple(morse)
+
+
+@lru_cache(maxsize=16)
+def compile_tape(text: str, n_led: int) -> MorseTape:
+    return MorseTape(text, n_led, load_font("font_5x7.bmp"), list(build_morse()))
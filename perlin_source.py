@@ -1,27 +1,47 @@
 #! /usr/bin/python
 
 from basic_source import BasicSource
+from upsampler import Upsampler
 from math import pi, cos
 from random import random
+from typing import List
+import numpy as np
 
 
 class PerlinSource(BasicSource):
     NOISE = [5, 11, 23, 47]
+    # the noise is evaluated at this many points per lattice cell of the finest octave and upsampled to the LEDs
+    SAMPLES_PER_CELL = 4
 
-    def __init__(self, ts, output_type):
+    def __init__(self, ts, output_type, noise: List[int] = None):
+        """
+        :param noise: frequencies of the octaves, i.e. number of lattice points, NOISE by default
+        """
         super().__init__(ts, output_type)
+        self.octaves = PerlinSource.NOISE if noise is None else noise
         self.noise = {}
-        self.noise_weight = [8 / 15, 4 / 15, 2 / 15, 1 / 15]
+        # each octave has half the weight of the previous one, e.g. 8/15, 4/15, 2/15, 1/15
+        n_octaves = len(self.octaves)
+        self.noise_weight = [2 ** (n_octaves - 1 - f) / (2 ** n_octaves - 1) for f in range(n_octaves)]
+        self.lattice_amplitude = np.zeros(0)
+        self.lattice_phase = np.zeros(0)
+        self.lattice_speed = np.zeros(0)
+        self.led_lattice = np.zeros((0, 0), dtype=np.intp)
+        self.led_weight = np.zeros((0, 0))
+        self.upsampler = None
 
     def init(self, n_led: int):
         super().init(n_led)
+        step = n_led // (PerlinSource.SAMPLES_PER_CELL * max(self.octaves))
+        self.upsampler = Upsampler(n_led, step, BasicSource.UPSAMPLING)
         self.build_noise()
+        self.build_lattice()
 
     def get_colors(self):
         return [("#0000AD", 101), ("#5040A0",)]
 
     def build_noise(self):
-        for freq in PerlinSource.NOISE:
+        for freq in self.octaves:
             self.noise[freq] = []
             for i in range(freq):
                 self.noise[freq].append((2 * random() - 1.0, 2 * random() * pi))  # amplitude, phase
@@ -46,10 +66,44 @@ class PerlinSource(BasicSource):
         # print("% 2.4f\t% 2.4f\t% 2.4f\t% 2.4f" % (x, n0, n1, n))
         return n + 0.5
 
+    def build_lattice(self):
+        """
+        Puts the lattice points of all octaves into one array and precomputes for every sample the two lattice points
+        it is interpolated from and their weights (the interpolation and the octave weight), so that
+        sample_noise for all samples and octaves becomes one gather from the lattice values of the frame.
+        The samples are the positions of the upsampler, on long strips they are fewer than LEDs
+        """
+        # the last sample may be after the end of the strip, it must not get to the next lattice point
+        leds = np.minimum(self.upsampler.positions, self.nLed - 1)
+        lattice = []
+        weight = []
+        offset = 0
+        for f in range(len(self.octaves)):
+            freq = self.octaves[f]
+            x = leds * (freq - 2) / self.nLed + 0.5
+            i = x.astype(np.intp)
+            dx = x - i
+            w = dx * dx * (3 - 2 * dx)
+            lattice.extend([offset + i, offset + i + 1])
+            weight.extend([dx * (1 - w) * self.noise_weight[f], (dx - 1) * w * self.noise_weight[f]])
+            offset += freq
+        self.led_lattice = np.array(lattice)
+        self.led_weight = np.array(weight)
+        self.lattice_amplitude = np.array([n[0] for freq in self.octaves for n in self.noise[freq]])
+        self.lattice_phase = np.array([n[1] for freq in self.octaves for n in self.noise[freq]])
+        self.lattice_speed = np.concatenate([np.full(freq, freq / 1000.0) for freq in self.octaves])
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        # the cosine is evaluated once per lattice point, not once per LED
+        values = self.lattice_amplitude * np.cos(self.time_speed * frame * self.lattice_speed + self.lattice_phase)
+        y = np.sum(self.led_weight * values[self.led_lattice], axis=0) + 0.5 * sum(self.noise_weight)
+        y = np.clip(self.upsampler.upsample(y), 0.0, 1.0)
+        return (100 * BasicSource.gain_array(y, 0.1)).astype(np.intp)
+
     def get_gradient_index(self, i, frame):
         y = 0
-        for f in range(len(PerlinSource.NOISE)):
-            freq = PerlinSource.NOISE[f]
+        for f in range(len(self.octaves)):
+            freq = self.octaves[f]
             x = i * (freq - 2) / self.nLed + 0.5
             y += self.sample_noise(freq, x, freq / 1000.0, self.time_speed * frame) * self.noise_weight[f]
         return int(100* BasicSource.gain(y, 0.1))
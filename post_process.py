@@ -0,0 +1,72 @@
+#! /usr/bin/python
+
+from typing import List, Tuple
+import numpy as np
+
+
+class PostProcessor:
+    """
+    Corrects the colors of the whole frame before it is sent to the strip: gamma correction by a lookup table per
+    channel, dimming of the whole strip and of its segments and the limit of the total current. The current is
+    estimated from the corrected values (the current of a channel is proportional to its PWM duty), when it is over
+    the limit, the whole frame is scaled down
+    """
+    def __init__(self, n_led: int, gamma=1.0, brightness: float = 1.0, segments: List[Tuple[int, int, float]] = None,
+                 max_current_ma: float = 0, channel_ma: float = 20, idle_ma: float = 1):
+        """
+        :param n_led: number of LEDs
+        :param gamma: one gamma for all channels or a tuple of three (R, G, B), 1 is no correction
+        :param brightness: global dimming, 0 to 1
+        :param segments: dimming of parts of the strip, (start, length, level)
+        :param max_current_ma: limit of the current of all LEDs in mA, 0 is no limit
+        :param channel_ma: current of one channel at full brightness in mA
+        :param idle_ma: current of one LED when it is black in mA
+        """
+        self.n_led = n_led
+        gamma = np.broadcast_to(np.asarray(gamma, dtype=np.float32), (3,))
+        # float table, the rounding is done once at the end
+        self.lut = (255 * (np.arange(256, dtype=np.float32)[np.newaxis, :] / 255) ** gamma[:, np.newaxis]).T
+        self.channels = np.arange(3)
+        self.brightness = brightness
+        self.segments = [] if segments is None else list(segments)
+        self.dim = np.ones((n_led, 1), dtype=np.float32)
+        self.build_dim()
+        self.max_current = max_current_ma
+        self.channel_ma = channel_ma
+        self.idle_ma = idle_ma
+        self.current = 0.0  # estimated current of the last frame before limiting in mA
+        self.scale = 1.0  # how much the last frame was scaled down to meet the limit
+
+    def build_dim(self):
+        self.dim.fill(self.brightness)
+        for start, length, level in self.segments:
+            self.dim[max(start, 0):max(start + length, 0)] *= level
+
+    def set_brightness(self, brightness: float):
+        self.brightness = brightness
+        self.build_dim()
+
+    def set_segment(self, start: int, length: int, level: float):
+        """
+        Sets the dimming of the segment, replaces the segment with the same start and length
+        """
+        self.segments = [s for s in self.segments if s[0:2] != (start, length)] + [(start, length, level)]
+        self.build_dim()
+
+    def apply(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        :param rgb: array of shape (n_led, 3) of bytes
+        :return: corrected colors, array of shape (n_led, 3) of bytes
+        """
+        out = self.lut[rgb, self.channels]
+        out *= self.dim
+        self.scale = 1.0
+        if self.max_current > 0:
+            idle = self.idle_ma * self.n_led
+            self.current = out.sum() * (self.channel_ma / 255) + idle
+            if self.current > self.max_current:
+                # the idle current cannot be scaled
+                self.scale = max(self.max_current - idle, 0) / (self.current - idle)
+                out *= self.scale
+        out += 0.5
+        return out.astype(np.uint8)
@@ -0,0 +1,129 @@
+#! /usr/bin/python
+
+from basic_source import BasicSource
+from strips import Strip
+import numpy as np
+import os
+import struct
+
+
+class Recording:
+    """
+    Recorded frames. The file starts with the header: magic, version, number of LEDs, frame time in ms and number of
+    channels (3, the order is RGB), all numbers are uint32 little endian. Then the frames follow, one byte per
+    channel, the number of frames is given by the file size, so the file can be appended to (RecordStrip with append)
+    """
+    HEADER = struct.Struct("<8sIIII")
+    MAGIC = b"LEDFRAME"
+    VERSION = 1
+
+    def __init__(self, file_name: str):
+        self.n_led, self.frame_time = Recording.read_header(file_name)
+        self.frames = np.memmap(file_name, dtype=np.uint8, mode="r", offset=Recording.HEADER.size)
+        n_frames = len(self.frames) // (self.n_led * 3)
+        self.frames = self.frames[0:n_frames * self.n_led * 3].reshape((n_frames, self.n_led, 3))
+
+    @staticmethod
+    def read_header(file_name: str):
+        """
+        :return: number of LEDs and frame time in ms
+        """
+        with open(file_name, "rb") as f:
+            header = f.read(Recording.HEADER.size)
+        if len(header) != Recording.HEADER.size:
+            raise ValueError("%s is not a recording of LED frames" % file_name)
+        magic, version, n_led, frame_time, channels = Recording.HEADER.unpack(header)
+        if magic != Recording.MAGIC or version != Recording.VERSION or channels != 3:
+            raise ValueError("%s is not a recording of LED frames" % file_name)
+        return n_led, frame_time
+
+    @staticmethod
+    def write_header(f, n_led, frame_time):
+        f.write(Recording.HEADER.pack(Recording.MAGIC, Recording.VERSION, n_led, frame_time, 3))
+
+
+class RecordStrip(Strip):
+    """
+    Output that writes the frames to a file, the frames are collected in memory and appended in bulk.
+    The colors must be packed in uint32 (output type LED), the frame is recorded by show(), the LEDs that are not set
+    keep the colors of the previous frame
+    """
+    def __init__(self, file_name: str, n_led: int, frame_time: int, batch_frames: int = 100, append: bool = False):
+        """
+        :param append: add the frames to the end of an existing recording with the same number of LEDs and frame time
+        """
+        self.frames = 0
+        if append and os.path.exists(file_name):
+            old_n_led, old_frame_time = Recording.read_header(file_name)
+            if (old_n_led, old_frame_time) != (n_led, frame_time):
+                raise ValueError("%s is a recording of %s LEDs with frame time %s ms, cannot append %s LEDs with %s ms"
+                                 % (file_name, old_n_led, old_frame_time, n_led, frame_time))
+            frame_size = n_led * 3
+            self.frames = (os.path.getsize(file_name) - Recording.HEADER.size) // frame_size
+            # a frame cut off by an interrupted recording is dropped
+            os.truncate(file_name, Recording.HEADER.size + self.frames * frame_size)
+            self.file = open(file_name, "ab")
+            print("Appending to %s after %s frames" % (file_name, self.frames))
+        else:
+            self.file = open(file_name, "wb")
+            Recording.write_header(self.file, n_led, frame_time)
+        self.batch = np.zeros((batch_frames, n_led, 3), dtype=np.uint8)
+        self.batch_size = 0
+
+    def write_frame(self, buffer: np.ndarray):
+        rgb = self.batch[self.batch_size]
+        rgb[:, 0] = (buffer >> 16) & 0xFF
+        rgb[:, 1] = (buffer >> 8) & 0xFF
+        rgb[:, 2] = buffer & 0xFF
+
+    def setPixelColor(self, i, color):
+        self.batch[self.batch_size, i] = ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+    def show(self):
+        rgb = self.batch[self.batch_size]
+        self.batch_size += 1
+        self.frames += 1
+        if self.batch_size == len(self.batch):
+            self.flush()
+        # the next frame starts from this one, like on the strip
+        self.batch[self.batch_size] = rgb
+
+    def flush(self):
+        self.file.write(self.batch[0:self.batch_size].tobytes())
+        self.file.flush()
+        self.batch_size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class ReplaySource(BasicSource):
+    """
+    Plays the recorded frames again and again, at full speed or with the frame time of the recording
+    """
+    def __init__(self, file_name: str, output_type):
+        super().__init__(1, output_type)
+        self.rgb_only = True
+        self.recording = Recording(file_name)
+
+    def init(self, n_led):
+        super().init(n_led)
+        if n_led != self.recording.n_led:
+            print("Recording has %s LEDs, output has %s" % (self.recording.n_led, n_led))
+
+    def render_frame(self, frame: int) -> np.ndarray:
+        raise NotImplementedError("ReplaySource has no gradient, it renders only the recorded colors with render_rgb")
+
+    def render_rgb(self, frame: int) -> np.ndarray:
+        # frames in App start from 1
+        rgb = self.recording.frames[(frame - 1) % len(self.recording.frames)]
+        if self.recording.n_led != self.nLed:
+            padded = np.zeros((self.nLed, 3), dtype=np.uint8)
+            n = min(self.nLed, self.recording.n_led)
+            padded[0:n] = rgb[0:n]
+            rgb = padded
+        return rgb
+
+    def update_leds(self, frame: int, strip):
+        strip.write_frame(self.rgb_to_output(self.render_rgb(frame)))
@@ -0,0 +1,103 @@
+#! /usr/bin/python
+
+from basic_source import BasicSource
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import random
+import sys
+
+
+def render_worker(shm_name, source: BasicSource, condition, worker, workers, depth, first_frame, random_state):
+    """
+    Renders every workers-th frame into the ring buffer, the other frames are only advanced, so that the
+    stateful sources stay in sync with the other workers. All workers start with the same state of the source
+    and of the random generator (which is otherwise reseeded in the forked process)
+    """
+    random.setstate(random_state)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    header, frames = RenderAhead.map_buffer(shm, depth, source.nLed)
+    frame = first_frame
+    try:
+        while True:
+            if frame % workers != worker or header[0] >= frame:  # not ours, or already too late to show
+                source.advance(frame)
+                frame += 1
+                continue
+            with condition:
+                condition.wait_for(lambda: header[0] >= frame - depth)
+            rgb = source.render_rgb(frame)
+            slot = frame % depth
+            with condition:
+                if header[0] < frame and header[1 + slot] < frame:
+                    frames[slot] = rgb
+                    header[1 + slot] = frame
+                    condition.notify_all()
+            frame += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # the arrays must release the buffer before it is closed
+        header = frames = None
+        shm.close()
+
+
+class RenderAhead:
+    """
+    Renders the frames of the source in worker processes ahead of time into a ring buffer in shared memory.
+    The buffer starts with header of int64: the last frame taken from the buffer followed by the frame number
+    stored in each slot, then the slots with RGB colors follow. The workers write to the buffer and the main
+    process reads from it only under the condition lock.
+    """
+    WAIT_TIMEOUT = 1.0  # how often in seconds the main process checks that the workers are alive while it waits
+    def __init__(self, source: BasicSource, first_frame: int, workers: int = 3, depth: int = 8):
+        self.source = source
+        self.depth = depth
+        size = 8 * (depth + 1) + depth * source.nLed * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.header, self.frames = RenderAhead.map_buffer(self.shm, depth, source.nLed)
+        self.header[0] = first_frame - 1
+        self.header[1:] = -1
+        context = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn")
+        self.condition = context.Condition()
+        self.workers = [context.Process(target=render_worker, daemon=True,
+                                        args=(self.shm.name, source, self.condition, i, workers, depth, first_frame,
+                                              random.getstate()))
+                        for i in range(workers)]
+        for w in self.workers:
+            w.start()
+
+    @staticmethod
+    def map_buffer(shm: shared_memory.SharedMemory, depth, n_led):
+        header = np.ndarray((depth + 1,), dtype=np.int64, buffer=shm.buf)
+        frames = np.ndarray((depth, n_led, 3), dtype=np.uint8, buffer=shm.buf, offset=header.nbytes)
+        return header, frames
+
+    def get_frame(self, frame: int) -> np.ndarray:
+        """
+        Waits for the frame and takes it from the buffer. The frames can be skipped, the skipped ones are released
+        :return: colors of the frame, array of shape (nLed, 3) of bytes
+        """
+        slot = frame % self.depth
+        with self.condition:
+            if self.header[0] < frame - 1:
+                self.header[0] = frame - 1
+                self.condition.notify_all()
+            while not self.condition.wait_for(lambda: self.header[1 + slot] == frame, RenderAhead.WAIT_TIMEOUT):
+                for i, w in enumerate(self.workers):
+                    if not w.is_alive():
+                        raise RuntimeError("Render worker %s exited with code %s while frame %s was expected" %
+                                           (i, w.exitcode, frame))
+            rgb = self.frames[slot].copy()
+            self.header[0] = frame
+            self.condition.notify_all()
+        return rgb
+
+    def close(self):
+        for w in self.workers:
+            w.terminate()
+        for w in self.workers:
+            w.join()
+        del self.header, self.frames
+        self.shm.close()
+        self.shm.unlink()
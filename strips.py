@@ -0,0 +1,58 @@
+#! /usr/bin/python
+
+import numpy as np
+
+
+class Strip:
+    """
+    Output backend. The frame is written at once with write_frame, the buffer is an array with the color of every LED
+    in the format of the output type of the source: colors packed in uint32 for LED (STRIP and DUMMY outputs),
+    hex strings for HEX (LED output) and floats for Y (PLOT output).
+    setPixelColor is kept for the sources that write the pixels one by one
+    """
+    def begin(self):
+        pass
+
+    def setPixelColor(self, i, color):
+        pass
+
+    def write_frame(self, buffer: np.ndarray):
+        for i, color in enumerate(buffer.tolist()):
+            self.setPixelColor(i, color)
+
+    def show(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DummyStrip(Strip):
+    def __init__(self):
+        pass
+
+    def write_frame(self, buffer: np.ndarray):
+        pass
+
+
+class Ws281xStrip(Strip):
+    """
+    Adapter for rpi_ws281x PixelStrip
+    """
+    def __init__(self, num, pin, freq_hz, dma, invert, brightness, channel):
+        from rpi_ws281x import PixelStrip
+        self.strip = PixelStrip(num, pin, freq_hz, dma, invert, brightness, channel)
+
+    def begin(self):
+        self.strip.begin()
+
+    def setPixelColor(self, i, color):
+        self.strip.setPixelColor(i, color)
+
+    def write_frame(self, buffer: np.ndarray):
+        # PixelStrip.__setitem__ with a slice still calls ws2811_led_set for every LED in Python, this only saves
+        # the calls of setPixelColor and the conversion of the numpy values one by one
+        self.strip[0:len(buffer)] = buffer.tolist()
+
+    def show(self):
+        self.strip.show()
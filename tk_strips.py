@@ -3,37 +3,43 @@ import matplotlib
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from math import ceil, floor
+from strips import Strip
+from collections import deque
+import numpy as np
 
 matplotlib.use("TkAgg")
 
 
-class DummyStrip:
-    def __init__(self):
-        pass
-
-    def begin(self):
-        pass
-
-    def setPixelColor(self, i, color):
-        pass
-
-    def show(self):
-        pass
-
-
-class TkStrip:
+class TkStrip(Strip):
+    """
+    Shows the LEDs as rectangles on canvas, only the LEDs that changed since the last frame are updated.
+    With raster, the whole strip is one image, the rows of LEDs between the first and the last changed LED are put to
+    it at once in show(), this is faster for thousands of LEDs, but there are no spaces between the rows
+    """
     LED_WIDTH = 6
     LED_HEIGHT = 6
     LED_SPACE_H = 2
     LED_SPACE_V = 32
     LED_PER_ROW = 150
 
-    def __init__(self, nLed, app):
+    def __init__(self, nLed, app, raster=False):
         self.app = app
+        self.nLed = nLed
         self.root = Tk()
         self.leds = []
+        self.last = np.full(nLed, "white", dtype="<U7")
+        self.rows = ceil(nLed / TkStrip.LED_PER_ROW)
+        self.image = None
+        self.dirty_start = nLed  # range of LEDs changed since the last show, for raster
+        self.dirty_end = 0
         max_w = (TkStrip.LED_WIDTH + TkStrip.LED_SPACE_H) * TkStrip.LED_PER_ROW
-        max_h = (TkStrip.LED_HEIGHT + TkStrip.LED_SPACE_V) * ceil(nLed / TkStrip.LED_PER_ROW)
+        if raster:
+            self.image = PhotoImage(width=max_w, height=TkStrip.LED_HEIGHT * self.rows)
+            self.w = Canvas(self.root, width=max_w, height=TkStrip.LED_HEIGHT * self.rows, background="#000000")
+            self.w.pack()
+            self.w.create_image(0, 0, anchor=NW, image=self.image)
+            return
+        max_h = (TkStrip.LED_HEIGHT + TkStrip.LED_SPACE_V) * self.rows
         self.w = Canvas(self.root, width=max_w, height=max_h)
         self.w.pack()
         for i in range(nLed):
@@ -47,21 +53,91 @@ class TkStrip:
         self.root.mainloop()
 
     def setPixelColor(self, i, color):
-        self.w.itemconfig(self.leds[i], fill=color)
+        if self.last[i] == color:
+            return
+        self.last[i] = color
+        if self.image is None:
+            self.w.itemconfig(self.leds[i], fill=color)
+        else:
+            self.dirty_start = min(self.dirty_start, i)
+            self.dirty_end = max(self.dirty_end, i + 1)
+
+    def write_frame(self, buffer):
+        changed = np.flatnonzero(buffer != self.last)
+        if len(changed) == 0:
+            return
+        self.last[changed] = buffer[changed]
+        if self.image is None:
+            for i in changed.tolist():
+                self.w.itemconfig(self.leds[i], fill=self.last[i])
+        else:
+            self.dirty_start = min(self.dirty_start, int(changed[0]))
+            self.dirty_end = max(self.dirty_end, int(changed[-1]) + 1)
+
+    def put_raster(self):
+        """
+        Puts the changed rows to the image in one call, with a single row only its changed columns
+        """
+        per_row = TkStrip.LED_PER_ROW
+        first_row, last_row = self.dirty_start // per_row, (self.dirty_end - 1) // per_row
+        start, end = 0, per_row
+        if first_row == last_row:
+            start, end = self.dirty_start % per_row, (self.dirty_end - 1) % per_row + 1
+        rows = last_row - first_row + 1
+        colors = np.full(rows * per_row, "#000000", dtype="<U7")
+        leds = self.last[first_row * per_row:(last_row + 1) * per_row]
+        colors[0:len(leds)] = leds
+        pixels = np.full((rows, end - start, TkStrip.LED_WIDTH + TkStrip.LED_SPACE_H), "#000000", dtype="<U7")
+        space = TkStrip.LED_SPACE_H // 2
+        pixels[:, :, space:space + TkStrip.LED_WIDTH] = colors.reshape(rows, per_row)[:, start:end, np.newaxis]
+        lines = ["{%s}" % " ".join(line) for line in pixels.reshape(rows, -1).tolist()]
+        self.image.put(" ".join(line for line in lines for _ in range(TkStrip.LED_HEIGHT)),
+                       to=(start * (TkStrip.LED_WIDTH + TkStrip.LED_SPACE_H), first_row * TkStrip.LED_HEIGHT))
+        self.dirty_start = self.nLed
+        self.dirty_end = 0
 
     def show(self):
+        if self.dirty_end > self.dirty_start:
+            self.put_raster()
         self.root.after(1, self.app.update)
 
-class TkPlot:
-    def __init__(self, nLed, app):
+
+class TkPlot(Strip):
+    """
+    Plots the output values of the LEDs. The artists are created once and only their data are updated, the
+    static part (axes) is drawn once and the dynamic artists are blitted on top of it.
+    With history, the previous frames are shown as fading lines
+    """
+    def __init__(self, nLed, app, history=0):
         self.app = app
         self.nLed = nLed
         self.root = Tk()
         self.figure = Figure(figsize=(10, 4), dpi=100)
         self.plot = self.figure.add_subplot(1, 1, 1)
+        self.plot.axis([0, self.nLed, 0, 1])
         self.canvas = FigureCanvasTkAgg(self.figure, self.root)
         self.canvas.get_tk_widget().grid(row=0, column=0)
-        self.yvals = [0] * nLed
+        self.yvals = np.zeros(nLed)
+        self.offsets = np.zeros((nLed, 2))
+        self.offsets[:, 0] = np.arange(nLed)
+        self.history = deque(maxlen=history)
+        self.history_lines = [self.plot.plot(self.offsets[:, 0], self.yvals, linewidth=0.5,
+                                             alpha=(history - i) / (history + 1), animated=True)[0]
+                              for i in range(history)]
+        self.scatter = self.plot.scatter(self.offsets[:, 0], self.yvals, 4, marker='s', animated=True)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.canvas.draw()
+
+    def on_draw(self, event):
+        # the whole figure was redrawn (e.g. resized), the static background has to be copied again
+        self.background = self.canvas.copy_from_bbox(self.plot.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for line in self.history_lines:
+            self.plot.draw_artist(line)
+        self.plot.draw_artist(self.scatter)
 
     def begin(self):
         self.show()
@@ -70,10 +146,18 @@ class TkPlot:
     def setPixelColor(self, i, color):
         self.yvals[i] = color
 
+    def write_frame(self, buffer):
+        self.yvals[:] = buffer
+
     def show(self):
-        xvals = range(self.nLed)
-        self.plot.clear()
-        self.plot.scatter(xvals, self.yvals, [4] * self.nLed, marker='s')
-        self.plot.axis([0, self.nLed, 0, 1])
-        self.canvas.draw()
+        for line, yvals in zip(self.history_lines, self.history):
+            line.set_ydata(yvals)
+        if self.history.maxlen > 0:
+            self.history.appendleft(self.yvals.copy())
+        self.offsets[:, 1] = self.yvals
+        self.scatter.set_offsets(self.offsets)
+        if self.background is not None:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+            self.canvas.blit(self.plot.bbox)
         self.root.after(1, self.app.update)
@@ -0,0 +1,51 @@
+#! /usr/bin/python
+
+from math import ceil
+import numpy as np
+
+
+class Upsampler:
+    """
+    Interpolates values sampled every step LEDs to all LEDs, for the sources whose detail is coarser than one LED.
+    The sample j is at LED j * step, the last sample is at or after the last LED. The sample indices and weights
+    of every LED are precomputed, so the upsampling is one gather and sum
+    """
+    METHODS = ["LINEAR", "CUBIC"]
+
+    def __init__(self, n_led: int, step: int, method: str = "CUBIC"):
+        """
+        :param n_led: number of LEDs
+        :param step: distance of the samples in LEDs
+        :param method: LINEAR or CUBIC (Catmull-Rom)
+        """
+        if method not in Upsampler.METHODS:
+            raise ValueError("Unknown upsampling %s, use one of %s" % (method, ", ".join(Upsampler.METHODS)))
+        self.n_led = n_led
+        self.step = max(1, step)
+        n_samples = int(ceil((n_led - 1) / self.step)) + 1 if n_led > 0 else 0
+        self.positions = np.arange(n_samples) * self.step
+        u = np.arange(n_led) / self.step
+        j = u.astype(np.intp)
+        f = u - j
+        if method == "LINEAR":
+            self.index = np.array([j, j + 1])
+            self.weight = np.array([1 - f, f])
+        else:
+            f2 = f * f
+            f3 = f2 * f
+            self.index = np.array([j - 1, j, j + 1, j + 2])
+            self.weight = np.array([-f3 + 2 * f2 - f, 3 * f3 - 5 * f2 + 2, -3 * f3 + 4 * f2 + f, f3 - f2]) / 2
+        # the samples outside of the strip repeat the ones at the ends
+        np.clip(self.index, 0, max(n_samples - 1, 0), out=self.index)
+
+    def get_samples(self) -> int:
+        return len(self.positions)
+
+    def upsample(self, values: np.ndarray) -> np.ndarray:
+        """
+        :param values: array of length get_samples(), values at positions
+        :return: array of length n_led
+        """
+        if self.step == 1:
+            return values[0:self.n_led]
+        return np.einsum("ij,ij->j", self.weight, values[self.index])